@@ -0,0 +1,510 @@
+import os
+import re
+import json
+import mmap
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, List, Dict, Tuple
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from embeddings import embed_texts, get_embedding_backend, EMBED_BACKEND
+from coldstart import lazy_import
+
+# both load on first use: the serving path never needs pptx, and a worker with
+# retrieval disabled never needs faiss
+faiss = lazy_import("faiss")
+pptx = lazy_import("pptx")
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: the in-process lock only
+    fcntl = None
+
+load_dotenv()
+
+# CONFIG
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_ppt.index")  # ingestion working copy
+RAG_MANIFEST_PATH = os.getenv("RAG_MANIFEST_PATH", "./rag_chunks.sqlite3")
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", 1200))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", 150))
+RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", 64))
+SUPPORTED_EXTENSIONS = (".pptx", ".txt", ".md")
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")  # flat | ivf_flat | ivf_pq | hnsw
+RAG_METRIC = os.getenv("RAG_METRIC", "l2")  # l2 | ip (inner product over normalized vectors)
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", 0))  # 0 -> ~4*sqrt(n)
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", 16))
+RAG_PQ_M = int(os.getenv("RAG_PQ_M", 64))
+RAG_PQ_NBITS = int(os.getenv("RAG_PQ_NBITS", 8))
+RAG_HNSW_M = int(os.getenv("RAG_HNSW_M", 32))
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", 80))
+RAG_HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", 64))
+RAG_TRAIN_SAMPLE = int(os.getenv("RAG_TRAIN_SAMPLE", 100000))
+RAG_RETRAIN_FACTOR = float(os.getenv("RAG_RETRAIN_FACTOR", 4))
+RAG_STORE_DIR = os.getenv("RAG_STORE_DIR", "./rag_store")
+RAG_KEEP_VERSIONS = int(os.getenv("RAG_KEEP_VERSIONS", 3))
+RAG_POLL_SECONDS = float(os.getenv("RAG_POLL_SECONDS", 2))
+
+logger = logging.getLogger("medisos")
+
+# Loading
+def pptx_to_text(path: str):
+    if pptx is None:
+        raise HTTPException(status_code=500, detail="python-pptx not installed")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"PPTX not found: {path}")
+    prs = pptx.Presentation(path)
+    slides_text = []
+    for i, slide in enumerate(prs.slides):
+        parts = []
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                t = shape.text.strip()
+                if t:
+                    parts.append(t)
+        slides_text.append("\n".join(parts) if parts else f"[slide {i+1} - no text]")
+    return slides_text
+
+def text_file_sections(path: str) -> List[str]:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        raw = f.read()
+    return [p.strip() for p in re.split(r"\n\s*\n", raw) if p.strip()]
+
+def load_sections(path: str) -> List[str]:
+    if path.lower().endswith(".pptx"): return pptx_to_text(path)
+    return text_file_sections(path)
+
+def expand_sources(sources: List[str]) -> List[str]:
+    # directories contribute every supported file below them, in a stable order
+    out = []
+    for src in sources:
+        if os.path.isdir(src):
+            for root, _, files in os.walk(src):
+                out.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+        elif os.path.exists(src):
+            out.append(src)
+        else:
+            logger.warning("RAG source missing: %s", src)
+    return sorted(set(os.path.abspath(p) for p in out))
+
+# Chunking
+def _split_long(text: str, max_chars: int, overlap: int) -> List[str]:
+    pieces = [s for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+    chunks, cur = [], ""
+    for piece in pieces:
+        while len(piece) > max_chars:  # no sentence boundary to use: hard split
+            if cur: chunks.append(cur); cur = ""
+            chunks.append(piece[:max_chars]); piece = piece[max_chars - overlap:]
+        if cur and len(cur) + 1 + len(piece) > max_chars:
+            chunks.append(cur)
+            tail = cur[-overlap:] if overlap else ""
+            cur = (tail + " " + piece).strip() if len(tail) + 1 + len(piece) <= max_chars else piece
+        else:
+            cur = (cur + " " + piece).strip()
+    if cur: chunks.append(cur)
+    return chunks
+
+def chunk_sections(sections: List[str], max_chars: int = RAG_CHUNK_CHARS, overlap: int = RAG_CHUNK_OVERLAP) -> List[str]:
+    """Bound every passage to `max_chars`; short sections (a slide, a paragraph) stay whole."""
+    chunks = []
+    for section in sections:
+        section = section.strip()
+        if not section: continue
+        chunks.extend([section] if len(section) <= max_chars else _split_long(section, max_chars, overlap))
+    return chunks
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_id(source: str, ordinal: int) -> int:
+    # stable across runs: a chunk keeps its id while its position in the source holds,
+    # so an edited slide is an in-place upsert rather than a delete + add
+    digest = hashlib.sha1(f"{source}#{ordinal}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & ((1 << 63) - 1)
+
+# Manifest: which chunk ids exist, where they came from and what they contained
+class ChunkManifest:
+    def __init__(self, path: str = RAG_MANIFEST_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, source TEXT NOT NULL, "
+                          "ordinal INTEGER NOT NULL, content_hash TEXT NOT NULL, text TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_source ON chunks (source)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?,?)", (key, value))
+
+    def hashes(self) -> Dict[int, Tuple[str, str]]:
+        return {cid: (src, h) for cid, src, h in self.conn.execute("SELECT id, source, content_hash FROM chunks")}
+
+    def upsert(self, rows: List[Tuple[int, str, int, str, str]]):
+        self.conn.executemany("INSERT OR REPLACE INTO chunks (id, source, ordinal, content_hash, text) VALUES (?,?,?,?,?)", rows)
+
+    def delete(self, ids: List[int]):
+        self.conn.executemany("DELETE FROM chunks WHERE id=?", [(i,) for i in ids])
+
+    def clear(self):
+        self.conn.execute("DELETE FROM chunks")
+
+    def texts(self) -> Dict[int, str]:
+        return {cid: text for cid, text in self.conn.execute("SELECT id, text FROM chunks")}
+
+    def commit(self): self.conn.commit()
+    def rollback(self): self.conn.rollback()
+    def close(self): self.conn.close()
+
+# Index maintenance
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+def index_spec(index_type: str = RAG_INDEX_TYPE, metric: str = RAG_METRIC) -> str:
+    return f"{index_type}:{metric}"
+
+def prepare_vectors(vectors, metric: str = RAG_METRIC) -> np.ndarray:
+    x = np.ascontiguousarray(np.asarray(vectors, dtype="float32"))
+    if metric == "ip":
+        # inner product over unit vectors == cosine similarity
+        x = x.copy(); faiss.normalize_L2(x)
+    return x
+
+def _pq_subquantizers(d: int, m: int) -> int:
+    # PQ needs d % m == 0; step down to the nearest divisor
+    while d % m: m -= 1
+    return m
+
+def make_index(d: int, n: int, index_type: str = RAG_INDEX_TYPE, metric: str = RAG_METRIC):
+    """Untrained index of `index_type` sized for about `n` vectors, accepting add_with_ids."""
+    if index_type not in INDEX_TYPES: raise ValueError(f"Unknown index type: {index_type}")
+    mt = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(d, RAG_HNSW_M, mt)
+        hnsw.hnsw.efConstruction = RAG_HNSW_EF_CONSTRUCTION
+        return faiss.IndexIDMap2(hnsw)
+    # faiss wants ~39 training points per centroid (and per PQ code)
+    nlist = max(1, min(RAG_IVF_NLIST or int(4 * np.sqrt(max(n, 1))), n // 39))
+    if index_type == "ivf_pq" and n < 39 * (1 << RAG_PQ_NBITS):
+        logger.info("Only %d vectors: too few to train PQ, using ivf_flat", n)
+        index_type = "ivf_flat"
+    if index_type == "ivf_flat" and nlist < 2:
+        logger.info("Only %d vectors: too few for IVF, using flat", n)
+        index_type = "flat"
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlat(d, mt))
+    quantizer = faiss.IndexFlat(d, mt)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, d, nlist, mt)
+    return faiss.IndexIVFPQ(quantizer, d, nlist, _pq_subquantizers(d, RAG_PQ_M), RAG_PQ_NBITS, mt)
+
+def build_index(vectors, ids, index_type: str = RAG_INDEX_TYPE, metric: str = RAG_METRIC):
+    x = prepare_vectors(vectors, metric)
+    index = make_index(x.shape[1], x.shape[0], index_type, metric)
+    if not index.is_trained:
+        sample = x
+        if len(x) > RAG_TRAIN_SAMPLE:
+            sample = x[np.random.default_rng(0).choice(len(x), RAG_TRAIN_SAMPLE, replace=False)]
+        index.train(sample)
+    index.add_with_ids(x, np.asarray(ids, dtype="int64"))
+    return index
+
+def configure_search(index):
+    """Apply query-time knobs (IVF nprobe, HNSW efSearch) to a loaded index."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = RAG_IVF_NPROBE
+    except Exception:
+        pass
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if hasattr(base, "hnsw"): base.hnsw.efSearch = RAG_HNSW_EF_SEARCH
+    return index
+
+def index_metric(index) -> str:
+    return "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+def can_update_in_place(index, index_type: str, removing: bool, total_after: int, trained_size: int) -> bool:
+    if index_type == "hnsw": return not removing  # HNSW graphs cannot drop vectors
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # centroids trained on a much smaller corpus stop partitioning it well
+        return trained_size > 0 and total_after <= RAG_RETRAIN_FACTOR * trained_size
+    return True
+
+def write_index_atomic(index, path: str):
+    tmp = f"{path}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+_SYNC_LOCK = asyncio.Lock()
+
+@asynccontextmanager
+async def sync_lock(manifest_path: str):
+    # one sync at a time across workers too: they share the working index and the manifest
+    async with _SYNC_LOCK:
+        with open(f"{manifest_path}.lock", "a") as f:  # closing it drops the flock
+            if fcntl is not None: await asyncio.to_thread(fcntl.flock, f.fileno(), fcntl.LOCK_EX)
+            yield
+
+async def _embed_in_batches(texts: List[str], embedding_backend: Optional[str], batch_size: int) -> List[np.ndarray]:
+    vectors: List[np.ndarray] = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(await embed_texts(texts[i:i+batch_size], backend=embedding_backend))
+    return vectors
+
+async def sync_sources(sources: List[str], idx_path: str = FAISS_INDEX_PATH, manifest_path: str = RAG_MANIFEST_PATH,
+                       embedding_backend: Optional[str] = None, batch_size: int = RAG_EMBED_BATCH, prune: bool = True,
+                       index_type: str = RAG_INDEX_TYPE, metric: str = RAG_METRIC, store_dir: str = RAG_STORE_DIR) -> Dict:
+    """Bring the index in line with `sources`, embedding only new or changed chunks.
+
+    Chunks are upserted/deleted by stable id in an ID-mapped FAISS index. With
+    `prune`, chunks whose source is no longer listed are removed too. A change of
+    embedding backend, index type or metric, a removal from HNSW, or an IVF corpus
+    that outgrew its training set triggers a full rebuild; unchanged passages are
+    then re-read from the embedding cache rather than re-embedded. Any change is
+    published as a new serving snapshot under `store_dir`. Concurrent syncs, in this
+    worker or another, take turns on a lock file next to the manifest.
+    """
+    if faiss is None: raise HTTPException(status_code=500, detail="faiss not installed")
+    async with sync_lock(manifest_path):
+        files = await asyncio.to_thread(expand_sources, sources)
+        wanted: Dict[int, Tuple[str, int, str, str]] = {}
+        for path in files:
+            chunks = chunk_sections(await asyncio.to_thread(load_sections, path))
+            for ordinal, text in enumerate(chunks):
+                wanted[chunk_id(path, ordinal)] = (path, ordinal, content_hash(text), text)
+        if not wanted: raise HTTPException(status_code=400, detail="No document text")
+
+        backend = get_embedding_backend(embedding_backend)
+        manifest = ChunkManifest(manifest_path)
+        try:
+            index = faiss.read_index(idx_path) if os.path.exists(idx_path) else None
+            same_model = manifest.get_meta("embedding_model") == backend.cache_model
+            known = manifest.hashes() if same_model else {}
+            changed = [cid for cid, (_, _, h, _) in wanted.items() if known.get(cid, (None, None))[1] != h]
+            stale = [cid for cid, (src, _) in known.items() if cid not in wanted and (prune or src in files)]
+            ids_out = [cid for cid in changed if cid in known] + stale
+
+            full = (index is None or not same_model or manifest.get_meta("index_spec") != index_spec(index_type, metric)
+                    or not can_update_in_place(index, index_type, bool(ids_out), len(known) - len(stale) + len(changed),
+                                               int(manifest.get_meta("trained_size") or 0)))
+            vectors = await _embed_in_batches([wanted[cid][3] for cid in changed], embedding_backend, batch_size)
+            if full:
+                fresh = dict(zip(changed, vectors))
+                unchanged = [cid for cid in wanted if cid not in fresh]
+                fresh.update(zip(unchanged, await _embed_in_batches([wanted[cid][3] for cid in unchanged], embedding_backend, batch_size)))
+                ids = list(wanted)
+                index = await asyncio.to_thread(build_index, np.stack([fresh[cid] for cid in ids]), ids, index_type, metric)
+                manifest.clear()
+                manifest.upsert([(cid, *wanted[cid]) for cid in ids])
+                manifest.set_meta("trained_size", str(len(ids)))
+            else:
+                if ids_out: index.remove_ids(np.array(ids_out, dtype="int64"))
+                if vectors: index.add_with_ids(prepare_vectors(np.stack(vectors), metric), np.array(changed, dtype="int64"))
+                manifest.delete(stale)
+                manifest.upsert([(cid, *wanted[cid]) for cid in changed])
+            manifest.set_meta("embedding_model", backend.cache_model)
+            manifest.set_meta("index_spec", index_spec(index_type, metric))
+            await asyncio.to_thread(write_index_atomic, index, idx_path)
+            manifest.commit()
+            version = read_current_version(store_dir)
+            if full or changed or stale or version is None:
+                version = await asyncio.to_thread(publish_snapshot, index, manifest.texts(), store_dir, RAG_KEEP_VERSIONS,
+                                                  embedding_backend or EMBED_BACKEND, backend.cache_model)
+        except BaseException:
+            manifest.rollback()
+            raise
+        finally:
+            manifest.close()
+
+    added = sum(1 for cid in changed if cid not in known)
+    return {"sources": len(files), "chunks": len(wanted), "added": added, "updated": len(changed) - added,
+            "deleted": len(stale), "unchanged": len(wanted) - len(changed), "embedded": len(vectors),
+            "rebuilt": full, "index": index_spec(index_type, metric), "version": version}
+
+# Serving snapshots
+# Every publish writes an immutable version directory
+#   rag_store/<version>/index.faiss     the FAISS index, opened read-only with mmap
+#   rag_store/<version>/passages.bin    UTF-8 passage texts, back to back
+#   rag_store/<version>/passages.idx    (id, offset, length) records sorted by id
+#   rag_store/<version>/meta.json       the embedding backend queries must use
+# and then atomically repoints rag_store/CURRENT. Workers map the files instead of
+# copying them, so N workers share one copy in the page cache, and each worker
+# polls CURRENT and swaps to a new version without a restart.
+PASSAGE_DTYPE = np.dtype([("id", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+CURRENT_POINTER = "CURRENT"
+
+def write_passage_store(docs: Dict[int, str], directory: str):
+    ids = sorted(docs)
+    table = np.zeros(len(ids), dtype=PASSAGE_DTYPE)
+    offset = 0
+    with open(os.path.join(directory, "passages.bin"), "wb") as f:
+        for i, cid in enumerate(ids):
+            data = docs[cid].encode("utf-8")
+            f.write(data)
+            table[i] = (cid, offset, len(data)); offset += len(data)
+    table.tofile(os.path.join(directory, "passages.idx"))
+
+class PassageStore:
+    """Read-only, memory-mapped id -> passage text lookup."""
+
+    def __init__(self, directory: str):
+        idx_path = os.path.join(directory, "passages.idx")
+        bin_path = os.path.join(directory, "passages.bin")
+        self.table = np.memmap(idx_path, dtype=PASSAGE_DTYPE, mode="r") if os.path.getsize(idx_path) else np.zeros(0, PASSAGE_DTYPE)
+        self.ids = self.table["id"]
+        self._file = open(bin_path, "rb")
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(bin_path) else b""
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, cid: int) -> Optional[str]:
+        i = int(np.searchsorted(self.ids, cid))
+        if i >= len(self.ids) or self.ids[i] != cid: return None
+        _, offset, length = self.table[i]
+        return self.data[offset:offset+length].decode("utf-8")
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap): self.data.close()
+        self._file.close()
+
+def read_index_mmap(path: str):
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if ifc:
+        # faiss rejects MMAP_IFC combined with MMAP for IVF indexes; fall back to plain mmap
+        try:
+            return faiss.read_index(path, flags | ifc)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path, flags)
+
+def read_current_version(store_dir: str = RAG_STORE_DIR) -> Optional[str]:
+    try:
+        with open(os.path.join(store_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish_snapshot(index, docs: Dict[int, str], store_dir: str = RAG_STORE_DIR, keep: int = RAG_KEEP_VERSIONS,
+                     embedding_backend: Optional[str] = None, embedding_model: Optional[str] = None) -> str:
+    os.makedirs(store_dir, exist_ok=True)
+    # names sort chronologically, which prune_snapshots relies on
+    version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(store_dir, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+    faiss.write_index(index, os.path.join(tmp_dir, "index.faiss"))
+    write_passage_store(docs, tmp_dir)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"embedding_backend": embedding_backend, "embedding_model": embedding_model}, f)
+    os.replace(tmp_dir, os.path.join(store_dir, version))
+    pointer_tmp = os.path.join(store_dir, f".{CURRENT_POINTER}.{version}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version); f.flush(); os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(store_dir, CURRENT_POINTER))
+    prune_snapshots(store_dir, keep)
+    return version
+
+def prune_snapshots(store_dir: str = RAG_STORE_DIR, keep: int = RAG_KEEP_VERSIONS):
+    # workers still mapping an old version keep their pages after unlink (POSIX)
+    current = read_current_version(store_dir)
+    versions = sorted(v for v in os.listdir(store_dir) if not v.startswith(".") and v != CURRENT_POINTER
+                      and os.path.isdir(os.path.join(store_dir, v)))
+    for v in versions[:-keep] if keep > 0 else versions:
+        if v != current: shutil.rmtree(os.path.join(store_dir, v), ignore_errors=True)
+
+class Snapshot:
+    def __init__(self, version: str, directory: str):
+        self.version = version
+        self.index = configure_search(read_index_mmap(os.path.join(directory, "index.faiss")))
+        self.passages = PassageStore(directory)
+        self.dim = self.index.d
+        self.metric = index_metric(self.index)
+        try:
+            with open(os.path.join(directory, "meta.json")) as f: meta = json.load(f)
+        except FileNotFoundError:
+            meta = {}  # published before backends were recorded
+        self.embedding_backend: Optional[str] = meta.get("embedding_backend")  # None -> EMBED_BACKEND
+        self.refs = 0  # searches using it right now; guarded by the store's lock
+        self.retired = False
+
+    def close(self):
+        # dropping the index unmaps it; the passage store holds a file handle and a mapping
+        self.passages.close()
+        self.index = None
+
+class RetrievalStore:
+    """The serving side: the current snapshot, re-checked at most every `poll_seconds`."""
+
+    def __init__(self, store_dir: str = RAG_STORE_DIR, poll_seconds: float = RAG_POLL_SECONDS):
+        self.store_dir = store_dir
+        self.poll_seconds = poll_seconds
+        self._snapshot: Optional[Snapshot] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._snapshot.version if self._snapshot else None
+
+    @property
+    def embedding_backend(self) -> Optional[str]:
+        # what queries must be embedded with to match the loaded index; no polling here
+        return self._snapshot.embedding_backend if self._snapshot else None
+
+    def current(self) -> Optional[Snapshot]:
+        if time.monotonic() - self._checked >= self.poll_seconds:
+            self.refresh()
+        return self._snapshot
+
+    @contextmanager
+    def use(self):
+        """The current snapshot (or None), kept open until the block exits even if
+        a newer version is swapped in meanwhile."""
+        self.current()
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None: snapshot.refs += 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                with self._lock:
+                    snapshot.refs -= 1
+                    if snapshot.retired and snapshot.refs == 0: snapshot.close()
+
+    def refresh(self, force: bool = False) -> bool:
+        if faiss is None: return False
+        with self._lock:
+            self._checked = time.monotonic()
+            version = read_current_version(self.store_dir)
+            if version is None: return self._snapshot is not None
+            if self._snapshot is not None and self._snapshot.version == version and not force: return True
+            try:
+                snapshot = Snapshot(version, os.path.join(self.store_dir, version))
+            except Exception as e:
+                logger.error("Loading RAG snapshot %s failed: %s", version, e)
+                return self._snapshot is not None
+            # in-flight searches hold the old snapshot open; the last one out closes it
+            old, self._snapshot = self._snapshot, snapshot
+            if old is not None:
+                old.retired = True
+                if old.refs == 0: old.close()
+            logger.info("RAG snapshot %s loaded (%d passages)", version, len(snapshot.passages))
+            return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None: return {"loaded": False}
+            return {"loaded": True, "version": snapshot.version, "vectors": snapshot.index.ntotal, "dim": snapshot.dim,
+                    "passages": len(snapshot.passages), "embedding_backend": snapshot.embedding_backend or EMBED_BACKEND}
@@ -1,251 +1,103 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import json
-import pickle
+import asyncio
 import logging
+import anyio
+from contextlib import asynccontextmanager
 from typing import Optional, List, Dict
-from datetime import datetime, timedelta
+from datetime import datetime
 
-import requests
-import numpy as np
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends, Body, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Body, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-
-try:
-    import faiss
-except Exception:
-    faiss = None
-try:
-    from pptx import Presentation
-except Exception:
-    Presentation = None
+
+from coldstart import lazy_import, StartupTimer
+
+# heavy optional modules load on first use, not when a worker boots
+faiss = lazy_import("faiss")
 
 load_dotenv()
 
+from metrics import (stage, STAGE_SECONDS, render_metrics, register_collector, install_trace_logging, MetricsMiddleware,
+                     METRICS_ENABLED, LOG_TRACE_IDS)
+from profiler import PROFILER, PROFILER_ENABLED
+from db import SessionLocal, get_db, unit_of_work, write_behind, DB_WRITE_BEHIND
+from models import User, Psychologist, Session, Message, Report
+from auth import create_access_token, get_user_from_token, cached_user, invalidate_user, auth_stats
+from passwords import hash_password, verify_password, shutdown_pool, password_stats
+from context import CONTEXT_CACHE, assemble_context, get_encoding
+from summaries import update_session_summary, schedule_summary_refresh
+from history import message_page, iter_export_rows, parse_fields, ndjson_lines, csv_lines, MESSAGE_FIELDS
+from mailer import queue_email, email_dispatcher
+from providers import (call_openrouter_chat, stream_openrouter_chat, close_client, request_deadline, provider_stats,
+                       ProviderUnavailable)
+from embeddings import EMBED_CACHE, embed_texts
+from RAG import sync_sources, prepare_vectors, RetrievalStore
+from risk import quick_urgent_check, local_risk_screen, llm_classify_risk, risk_stats, RISK_ESCALATE_SCORE
+from response_cache import RESPONSE_CACHE, RESPONSE_CACHE_ENABLED, cache_scope, cacheable_risk, mentions_any
+
 # CONFIG
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
-DATABASE_URL = os.getenv("DATABASE_URL", "#")
 FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_ppt.index")
 PPTX_PATH = os.getenv("PPTX_PATH", "/mnt/data/AI-powered Mental health Asssessment System.pptx")
-JWT_SECRET = os.getenv("JWT_SECRET", "change_this_super_secret")
-JWT_ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60*24*7
-
-CHAT_ENDPOINT = f"{OPENROUTER_BASE_URL}/chat/completions"
-EMBEDDINGS_ENDPOINT = f"{OPENROUTER_BASE_URL}/embeddings"
-
-# Email env
-SMTP_HOST = os.getenv("SMTP_HOST")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASS = os.getenv("SMTP_PASS")
+RAG_SOURCES = [s.strip() for s in os.getenv("RAG_SOURCES", PPTX_PATH).split(",") if s.strip()]  # files or directories
+RAG_ENABLED = os.getenv("RAG_ENABLED", "1") == "1"
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0") == "1"  # dev convenience; deploys run `python migrate.py`
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("medisos")
+if LOG_TRACE_IDS: install_trace_logging()
 
-# DB setup
-Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-
-# MODELS
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    first_name = Column(String(100), nullable=False)
-    last_name = Column(String(100), nullable=False)
-    email = Column(String(150), unique=True, nullable=False)
-    age_group = Column(String(50), nullable=True)
-    password_hash = Column(String(255), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class Psychologist(Base):
-    __tablename__ = "psychologists"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(200))
-    email = Column(String(255))
-    phone = Column(String(50), nullable=True)
-    notes = Column(Text, nullable=True)
-
-class Session(Base):
-    __tablename__ = "sessions"
-    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    started_at = Column(DateTime, default=datetime.utcnow)
-    ended_at = Column(DateTime, nullable=True)
-    status = Column(String(20), default="active")
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    user = relationship("User")
-
-class Message(Base):
-    __tablename__ = "messages"
-    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
-    session_id = Column(Integer, ForeignKey("sessions.id"))
-    sender = Column(String(20))  # 'user' or 'assistant'
-    text = Column(Text)
-    sentiment = Column(Float, nullable=True)
-    emotion = Column(String(50), nullable=True)
-    risk_score = Column(Integer, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-    session = relationship("Session")
-
-class Report(Base):
-    __tablename__ = "reports"
-    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
-    psychologist_id = Column(Integer, nullable=True)
-    summary = Column(Text)
-    risk_score = Column(Integer)
-    urgency = Column(String(20), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    user = relationship("User")
-    session = relationship("Session")
-
-# create tables if missing
-Base.metadata.create_all(bind=engine)
-
-# Security helpers
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-def verify_password(raw_password: str, hashed: str) -> bool:
-    return pwd_context.verify(raw_password, hashed)
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
-def decode_token(token: str):
-    try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Invalid token") from e
-def get_user_from_token(token: str, db):
-    payload = decode_token(token)
-    sub = payload.get("sub")
-    if not sub:
-        raise HTTPException(status_code=401, detail="Invalid token payload")
-    user = db.query(User).filter(User.id == int(sub)).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
-
-HEADERS = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
-
-def call_openrouter_chat(messages: List[Dict], model="openrouter/auto", max_tokens=512, temperature=0.2):
-    if OPENROUTER_API_KEY is None:
-        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
-    payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
-    r = requests.post(CHAT_ENDPOINT, headers=HEADERS, json=payload, timeout=60)
-    try:
-        r.raise_for_status()
-    except Exception:
-        logger.error("OpenRouter chat error: %s", r.text)
-        raise HTTPException(status_code=502, detail="LLM provider error")
-    return r.json()
-
-def get_openrouter_embeddings(texts: List[str], model="text-embedding-3-large"):
-    if OPENROUTER_API_KEY is None:
-        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
-    payload = {"model": model, "input": texts}
-    r = requests.post(EMBEDDINGS_ENDPOINT, headers=HEADERS, json=payload, timeout=60)
-    try:
-        r.raise_for_status()
-    except Exception:
-        logger.error("OpenRouter embeddings error: %s", r.text)
-        raise HTTPException(status_code=502, detail="Embeddings provider error")
-    return r.json().get("data", [])
-
-FAISS_INDEX = None
-DOCS = None
-EMBED_DIM = None
-def load_faiss_index(index_path: str = FAISS_INDEX_PATH):
-    global FAISS_INDEX, DOCS, EMBED_DIM
+# Serving index: a memory-mapped snapshot shared by all workers, hot-swapped on re-index
+RAG_STORE = RetrievalStore()
+def load_faiss_index(force: bool = False):
     if faiss is None:
         logger.warning("faiss not installed")
         return False
-    if not os.path.exists(index_path) or not os.path.exists("ppt_docs.pkl"):
+    ok = RAG_STORE.refresh(force)
+    if not ok:
         logger.info("Index or docs missing. Call /index_ppt.")
-        return False
-    FAISS_INDEX = faiss.read_index(index_path)
-    with open("ppt_docs.pkl","rb") as f:
-        DOCS = pickle.load(f)
-    EMBED_DIM = FAISS_INDEX.d
-    return True
+    return ok
 
 def query_faiss_topk(vector: List[float], top_k: int = 3):
-    if FAISS_INDEX is None:
-        ok = load_faiss_index()
-        if not ok:
+    with RAG_STORE.use() as snapshot:
+        if snapshot is None:
             return []
-    arr = np.array([vector]).astype("float32")
-    D, I = FAISS_INDEX.search(arr, top_k)
-    results = []
-    for idx, dist in zip(I[0], D[0]):
-        if idx < 0 or idx >= len(DOCS): continue
-        results.append({"id": int(idx), "text": DOCS[idx], "distance": float(dist)})
-    return results
-
-def pptx_to_text(path: str = PPTX_PATH):
-    if Presentation is None:
-        raise HTTPException(status_code=500, detail="python-pptx not installed")
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail=f"PPTX not found: {path}")
-    prs = Presentation(path)
-    slides_text = []
-    for i, slide in enumerate(prs.slides):
-        parts = []
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                t = shape.text.strip()
-                if t:
-                    parts.append(t)
-        slides_text.append("\n".join(parts) if parts else f"[slide {i+1} - no text]")
-    return slides_text
-
-def index_ppt_to_faiss(ppt_path: str = PPTX_PATH, idx_path: str = FAISS_INDEX_PATH, embedding_model="text-embedding-3-large"):
-    slides = pptx_to_text(ppt_path)
-    if not slides: raise HTTPException(status_code=400, detail="No slide text")
-    emb_resp = get_openrouter_embeddings(slides, model=embedding_model)
-    vectors = [np.array(item["embedding"], dtype="float32") for item in emb_resp]
-    d = vectors[0].shape[0]
-    index = faiss.IndexFlatL2(d)
-    index.add(np.stack(vectors))
-    faiss.write_index(index, idx_path)
-    with open("ppt_docs.pkl","wb") as f: pickle.dump(slides, f)
-    load_faiss_index(idx_path)
-    return {"indexed": len(slides)}
-
-# Safety helpers (unchanged)
-URGENT_KEYWORDS = ["kill myself","I want to die","End my life","suicide","hurt myself","It's over for me","I feel like jumping from the roof","Die","hang myself"]
-def quick_urgent_check(text: str) -> bool:
-    t = text.lower(); return any(k in t for k in URGENT_KEYWORDS)
-
-def llm_classify_risk(text: str) -> dict:
-    system = ("You are a safety classifier. Given a user message return ONLY JSON: "
-              '{"risk_score":int,"label":"low|medium|high","reason":"short"}')
-    messages = [{"role":"system","content":system}, {"role":"user","content":f'Classify:\n"""\n{text}\n"""'}]
+        arr = prepare_vectors([vector], snapshot.metric)
+        if arr.shape[1] != snapshot.dim:
+            # index was built with a different embedding backend
+            logger.warning("Query dim %d does not match index dim %d; re-run /index_ppt", arr.shape[1], snapshot.dim)
+            return []
+        with stage("faiss_search"):
+            D, I = snapshot.index.search(arr, top_k)
+        results = []
+        for idx, dist in zip(I[0], D[0]):
+            text = snapshot.passages.get(int(idx)) if idx >= 0 else None
+            if text is None: continue
+            results.append({"id": int(idx), "text": text, "distance": float(dist)})
+        return results
+
+async def index_ppt_to_faiss(sources: Optional[List[str]] = None, idx_path: str = FAISS_INDEX_PATH, embedding_backend: Optional[str] = None):
+    res = await sync_sources(sources or RAG_SOURCES, idx_path=idx_path, embedding_backend=embedding_backend)
+    # this worker swaps now; the others pick the new version up on their next poll
+    await asyncio.to_thread(load_faiss_index)
+    return res
+
+async def retrieve_context(text: str, top_k: int = 3) -> List[Dict]:
+    # retrieval is best-effort: any provider or index failure just means no references
+    if not RAG_ENABLED: return []
     try:
-        resp = call_openrouter_chat(messages, max_tokens=80, temperature=0.0)
-        assistant_text = resp["choices"][0]["message"]["content"]
-        s = assistant_text.find("{"); e = assistant_text.rfind("}")
-        if s != -1 and e != -1 and e > s:
-            return json.loads(assistant_text[s:e+1])
-    except Exception as e:
-        logger.warning("LLM risk classify failed: %s", e)
-    return {"risk_score":0,"label":"low","reason":"fallback"}
+        with stage("embed"):
+            # queries are embedded like the loaded snapshot's passages were (/index_ppt?backend=...)
+            emb = (await embed_texts([text], backend=RAG_STORE.embedding_backend))[0]
+        return await asyncio.to_thread(query_faiss_topk, emb, top_k)
+    except Exception:
+        return []
 
 def extract_trailing_json(text: str):
     text = text.strip()
@@ -258,26 +110,8 @@ def extract_trailing_json(text: str):
     except Exception:
         return text, {}
 
-# Email
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-def send_email(to_email: str, subject: str, body: str):
-    if not SMTP_HOST or not SMTP_USER or not SMTP_PASS:
-        logger.warning("SMTP not configured; skipping email")
-        return False
-    try:
-        msg = MIMEMultipart(); msg["From"]=SMTP_USER; msg["To"]=to_email; msg["Subject"]=subject
-        msg.attach(MIMEText(body,"plain"))
-        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT); s.starttls(); s.login(SMTP_USER, SMTP_PASS)
-        s.sendmail(SMTP_USER, to_email, msg.as_string()); s.quit()
-        return True
-    except Exception as e:
-        logger.error("Send email failed: %s", e); return False
-
-# FastAPI app + schemas
-app = FastAPI(title="Mental Health AI Assistant Backend (Int IDs)")
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+# Routes + schemas; the app itself is built by create_app() below
+router = APIRouter()
 
 class RegisterIn(BaseModel):
     first_name: str; last_name: str; email: str; password: str; age_group: Optional[str] = None
@@ -287,198 +121,502 @@ class ChatIn(BaseModel):
     session_id: Optional[int] = None
     message: str
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
-
 # Auth
-@app.post("/register")
-def register(payload: RegisterIn, db=Depends(get_db)):
-    if db.query(User).filter(User.email==payload.email).first():
-        raise HTTPException(status_code=400, detail="Email exists")
+# bcrypt runs in the password pool (passwords.py); only the DB work uses the threadpool
+def find_user_by_email(db, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email==email).first()
+
+def create_user(db, payload: RegisterIn, password_hash: str) -> User:
     user = User(first_name=payload.first_name.strip(), last_name=payload.last_name.strip(),
-                email=payload.email.strip(), age_group=payload.age_group,
-                password_hash=get_password_hash(payload.password))
+                email=payload.email.strip(), age_group=payload.age_group, password_hash=password_hash)
     db.add(user); db.commit(); db.refresh(user)
+    return user
+
+@router.post("/register")
+async def register(payload: RegisterIn, db=Depends(get_db)):
+    if await run_in_threadpool(find_user_by_email, db, payload.email):
+        raise HTTPException(status_code=400, detail="Email exists")
+    user = await run_in_threadpool(create_user, db, payload, await hash_password(payload.password))
     token = create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type":"bearer", "user_id": user.id}
 
-@app.post("/login")
-def login(payload: LoginIn, db=Depends(get_db)):
-    user = db.query(User).filter(User.email==payload.email).first()
-    if not user or not verify_password(payload.password, user.password_hash):
+@router.post("/login")
+async def login(payload: LoginIn, db=Depends(get_db)):
+    user = await run_in_threadpool(find_user_by_email, db, payload.email)
+    if not user or not await verify_password(payload.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type":"bearer", "user_id": user.id}
 
 # Psychologist endpoints
-@app.post("/psychologists")
+@router.post("/psychologists")
 def add_psychologist(data: Dict = Body(...), db=Depends(get_db)):
     p = Psychologist(name=data.get("name"), email=data.get("email"), phone=data.get("phone"), notes=data.get("notes"))
     db.add(p); db.commit(); db.refresh(p)
     return {"ok": True, "psychologist": {"id": p.id, "name": p.name, "email": p.email}}
 
-@app.get("/psychologists")
+@router.get("/psychologists")
 def list_psychologists(db=Depends(get_db)):
     ps = db.query(Psychologist).all()
     return {"psychologists": [{"id":p.id,"name":p.name,"email":p.email,"phone":p.phone} for p in ps]}
 
-@app.put("/users/{user_id}/psychologist/{psych_id}")
+@router.put("/users/{user_id}/psychologist/{psych_id}")
 def assign_psychologist(user_id: int, psych_id: int, db=Depends(get_db)):
     user = db.query(User).get(user_id); psych = db.query(Psychologist).get(psych_id)
     if not user or not psych: raise HTTPException(status_code=404, detail="Not found")
     user.psychologist_id = psych.id; db.commit()
+    invalidate_user(user_id)
     return {"ok": True}
 
 # Index PPT
-@app.post("/index_ppt")
-def index_ppt(db=Depends(get_db)):
+@router.post("/index_ppt")
+async def index_ppt(backend: Optional[str] = None):
     if faiss is None: raise HTTPException(status_code=500, detail="faiss not installed")
-    res = index_ppt_to_faiss()
-    return {"ok": True, "indexed": res["indexed"]}
+    res = await index_ppt_to_faiss(embedding_backend=backend)
+    return {"ok": True, "indexed": res["chunks"], **res}
 
-# Chat endpoint
-@app.post("/chat")
-def chat(payload: ChatIn = Body(...), authorization: Optional[str] = Header(None), db=Depends(get_db)):
-    token = None; user = None
-    if authorization:
-        try:
-            token = authorization.split(" ")[1]; user = get_user_from_token(token, db)
-        except Exception:
-            user = None
-
-    # create or fetch session
-    if payload.session_id:
-        session = db.query(Session).get(int(payload.session_id))
-        if not session:
-            # invalid id -> create new
-            session = Session(user_id=(user.id if user else None)); db.add(session); db.commit(); db.refresh(session)
-    else:
-        session = Session(user_id=(user.id if user else None)); db.add(session); db.commit(); db.refresh(session)
+# Embedding cache admin
+@router.get("/embedding_cache")
+def embedding_cache_stats():
+    return EMBED_CACHE.stats()
 
-    text = payload.message.strip()
-    # save user message
-    um = Message(session_id=session.id, sender="user", text=text)
-    db.add(um); db.commit(); db.refresh(um)
+@router.delete("/embedding_cache")
+def embedding_cache_invalidate(model: Optional[str] = None):
+    return {"ok": True, "model": model, "removed": EMBED_CACHE.invalidate(model)}
 
-    # quick keyword check
-    if quick_urgent_check(text):
-        reply = ("I'm very sorry you're feeling this way. If you are in immediate danger, please contact local emergency services now.")
-        am = Message(session_id=session.id, sender="assistant", text=reply, risk_score=100); db.add(am); db.commit()
-        return {"session_id": session.id, "reply": reply, "emergency": True, "metadata": {"risk_score":100}}
+@router.get("/response_cache")
+def response_cache_stats():
+    return RESPONSE_CACHE.stats()
 
-    # LLM risk classification
-    risk = llm_classify_risk(text)
-    if risk.get("risk_score",0) >= 70:
-        reply = ("I am concerned for your safety. Please contact emergency services. Would you like local resources?")
-        am = Message(session_id=session.id, sender="assistant", text=reply, risk_score=risk["risk_score"]); db.add(am); db.commit()
-        return {"session_id": session.id, "reply": reply, "emergency": True, "metadata": risk}
+@router.delete("/response_cache")
+def response_cache_clear():
+    RESPONSE_CACHE.clear()
+    return {"ok": True}
 
-    # RAG retrieval
-    retrieved = []
+@router.get("/email_outbox")
+def email_outbox_stats():
+    return email_dispatcher.stats()
+
+@router.get("/provider_stats")
+def provider_health():
+    return provider_stats()
+
+@router.get("/risk_stats")
+def risk_cascade_stats():
+    return risk_stats()
+
+# Metrics: stats the subsystems already keep are read at scrape time
+register_collector("medisos_embedding_cache", EMBED_CACHE.stats)
+register_collector("medisos_response_cache", RESPONSE_CACHE.stats)
+register_collector("medisos_context_cache", CONTEXT_CACHE.stats)
+register_collector("medisos_risk", risk_stats)
+register_collector("medisos_write_behind", write_behind.stats)
+register_collector("medisos_email_outbox", email_dispatcher.stats)
+register_collector("medisos_rag_index", RAG_STORE.stats)
+register_collector("medisos_provider", provider_stats)
+register_collector("medisos_auth", auth_stats)
+register_collector("medisos_passwords", password_stats)
+
+@router.get("/metrics")
+def prometheus_metrics():
+    if not METRICS_ENABLED: raise HTTPException(status_code=404, detail="Metrics disabled")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@router.get("/debug/profile")
+def debug_profile(reset: bool = False):
+    # collapsed stacks for flamegraph.pl / speedscope; PROFILER_ENABLED=1 to collect
+    if not PROFILER_ENABLED: raise HTTPException(status_code=404, detail="Profiler disabled")
+    return PlainTextResponse(PROFILER.collapsed(reset))
+
+async def auth_user_or_none(authorization: Optional[str], db):
+    # a cached user is answered inline; only a miss hops to the threadpool for the DB
+    if not authorization: return None
     try:
-        emb = get_openrouter_embeddings([text])[0]["embedding"]
-        retrieved = query_faiss_topk(emb, top_k=3)
+        token = authorization.split(" ")[1]
+        return cached_user(token) or await run_in_threadpool(get_user_from_token, token, db)
     except Exception:
-        retrieved = []
+        return None
+
+# Chat helpers: the ORM session is sync, so these run in the threadpool while the
+# provider calls stay on the event loop.
+
+def start_chat_turn(db, session_id: Optional[int], user, text: str) -> Dict:
+    """Load the session's history, then durably write the user's message (and the
+    session, if new) before any provider call: a disclosure is never lost to a
+    provider failure, a crash or a client that hangs up."""
+    user_id = user.id if user else None
+    # only the caller's own session (anonymous callers: anonymous sessions) carries over its history
+    owner = db.query(Session.user_id).filter(Session.id == int(session_id)).first() if session_id else None
+    exists = owner is not None and owner[0] == user_id
+    turn = {"session_id": (int(session_id) if exists else None),  # missing, invalid or foreign id -> create new
+            "user_id": user_id, "psychologist_id": (user.psychologist_id if user else None),
+            "text": text, "received_at": datetime.utcnow(), "history": None}
+    if exists:
+        # before the insert, so the current message is not part of its own history
+        with stage("history_load"):
+            turn["history"] = CONTEXT_CACHE.get(turn["session_id"]) or CONTEXT_CACHE.load(db, turn["session_id"])
+    with unit_of_work(db):
+        if not exists:
+            session = Session(user_id=turn["user_id"]); db.add(session); db.flush()
+            turn["session_id"] = session.id
+        db.add(Message(session_id=turn["session_id"], sender="user", text=text, created_at=turn["received_at"]))
+    return turn
+
+def chat_turn_rows(turn: Dict, reply: str, risk_score: Optional[int], emotion: Optional[str], with_report: bool) -> List:
+    sid = turn["session_id"]
+    rows = [Message(session_id=sid, sender="assistant", text=reply, risk_score=risk_score, emotion=emotion, created_at=datetime.utcnow())]
+    if with_report:
+        # short report
+        rows.append(Report(user_id=turn["user_id"], session_id=sid, summary=(reply[:200] + "..."), risk_score=risk_score, psychologist_id=turn["psychologist_id"]))
+    return rows
+
+def remember_turn(turn: Dict, reply: Optional[str]) -> int:
+    # keep the cached history window in step with what was just written
+    CONTEXT_CACHE.append(turn["session_id"], "user", turn["text"])
+    if reply is not None: CONTEXT_CACHE.append(turn["session_id"], "assistant", reply)
+    return turn["session_id"]
+
+def persist_chat_turn(db, turn: Dict, reply: Optional[str] = None, risk_score: Optional[int] = None,
+                      emotion: Optional[str] = None, with_report: bool = False, durable: bool = False) -> int:
+    """Write the assistant's reply and the report in one transaction; the user's
+    message is already stored by start_chat_turn.
+
+    With DB_WRITE_BEHIND these rows are queued and batch-inserted off the request
+    path; `durable` turns (safety replies) are always written inline. Returns the
+    session id.
+    """
+    if reply is None: return remember_turn(turn, None)
+    if DB_WRITE_BEHIND and not durable:
+        if write_behind.submit(chat_turn_rows(turn, reply, risk_score, emotion, with_report)):
+            return remember_turn(turn, reply)
+    with unit_of_work(db):
+        db.add_all(chat_turn_rows(turn, reply, risk_score, emotion, with_report))
+    return remember_turn(turn, reply)
+
+def finish_chat_turn(db, turn: Dict, assistant_full: str):
+    with stage("parse_reply"):
+        clean, metadata = extract_trailing_json(assistant_full)
+    # save the assistant message and the short report together
+    risk_score = int(metadata.get("risk_score", turn["risk"].get("risk_score",0)))
+    persist_chat_turn(db, turn, clean, risk_score, metadata.get("emotion"), with_report=True)
+    store_cached_reply(turn, clean, metadata)
+    return clean, metadata
+
+def finish_cached_turn(db, turn: Dict, hit: Dict):
+    metadata = hit["metadata"]
+    persist_chat_turn(db, turn, hit["reply"], int(metadata.get("risk_score", 0)), metadata.get("emotion"), with_report=True)
+    return hit["reply"], metadata
+
+def build_user_info(user) -> str:
+    if not user: return ""
+    user_info = f"User profile: first_name={user.first_name}, last_name={user.last_name}, age_group={user.age_group}."
+    psych = user.psychologist
+    if psych: user_info += f" Assigned psychologist: {psych['name']} ({psych['email']})."
+    return user_info
+
+PROMPT_VERSION = "1"  # bump when the system prompt changes; cached replies are scoped by it
+
+def build_chat_messages(text: str, user_info: str, retrieved: List[Dict], history: Optional[Dict] = None) -> List[Dict]:
+    system_prompt = ("You are Mental Health Assessor... (do NOT diagnose). After reply append JSON: {risk_score,int; emotion,str; confidence,float}." + user_info)
+    return assemble_context(system_prompt, text, history, retrieved)
 
-    # build system prompt
-    user_info = ""
-    if user:
-        user_info = f"User profile: first_name={user.first_name}, last_name={user.last_name}, age_group={user.age_group}."
-        if user.psychologist_id:
-            psych = db.query(Psychologist).get(user.psychologist_id)
-            if psych: user_info += f" Assigned psychologist: {psych.name} ({psych.email})."
+# Semantic response cache: only first turns (no history to depend on) the risk
+# pipeline rated low; see response_cache.py
+async def lookup_cached_reply(text: str, retrieved: List[Dict], user) -> Optional[Dict]:
+    try:
+        # retrieval just embedded the same text with this backend, so this is an embedding cache hit
+        vector = (await embed_texts([text], backend=RAG_STORE.embedding_backend))[0]
+    except Exception:
+        return None
+    psych = (user.psychologist if user else None) or {}
+    # the profile fields in the prompt: shared ones scope the entry, personal ones must not appear in it
+    scope = cache_scope(PROMPT_VERSION, [r["text"] for r in retrieved],
+                        [user.age_group, psych.get("name"), psych.get("email")] if user else [])
+    names = [user.first_name, user.last_name, psych.get("name"), psych.get("email")] if user else []
+    return {"vector": vector, "scope": scope, "names": names, "hit": await asyncio.to_thread(RESPONSE_CACHE.lookup, vector, scope)}
+
+def store_cached_reply(turn: Dict, reply: str, metadata: Dict):
+    entry = turn.get("cache")
+    if not entry or entry["hit"] or not cacheable_risk(metadata): return
+    # a reply naming the user or their psychologist is not reusable
+    if mentions_any(reply, entry["names"]): return
+    RESPONSE_CACHE.store(entry["vector"], entry["scope"], reply, metadata)
+
+async def prepare_chat_turn(payload: ChatIn, authorization: Optional[str], db) -> Dict:
+    """Shared front half of /chat and /chat/stream: session, safety screening, retrieval.
+
+    Returns either {"emergency": response} for a canned safety reply, or the prompt
+    messages plus what is needed to persist the completion afterwards. On a response
+    cache hit the turn comes back without messages and turn["cache"]["hit"] set.
+    """
+    user = await auth_user_or_none(authorization, db)
+    text = payload.message.strip()
+    turn = await run_in_threadpool(start_chat_turn, db, payload.session_id, user, text)
 
-    system_prompt = ("You are Mental Health Assessor... (do NOT diagnose). After reply append JSON: {risk_score,int; emotion,str; confidence,float}." + user_info)
-    messages = [{"role":"system","content":system_prompt}]
-    if retrieved:
-        docs_text = "\n\n---\n\n".join([d["text"] for d in retrieved])
-        messages.append({"role":"system","content":f"References:\n{docs_text}"})
-    messages.append({"role":"user","content":text})
+    # quick keyword check
+    with stage("urgent_check"):
+        urgent = quick_urgent_check(text)
+    if urgent:
+        reply = ("I'm very sorry you're feeling this way. If you are in immediate danger, please contact local emergency services now.")
+        session_id = await run_in_threadpool(persist_chat_turn, db, turn, reply, 100, None, False, True)
+        return {"emergency": {"session_id": session_id, "reply": reply, "emergency": True, "metadata": {"risk_score":100}}}
+
+    # clear cases are decided locally; otherwise the LLM classifier and RAG retrieval
+    # are independent, so run them concurrently
+    retrieval = asyncio.create_task(retrieve_context(text, top_k=3))
+    with stage("risk_local"):
+        risk = local_risk_screen(text)
+    if risk is None:
+        with stage("risk_llm"):
+            risk = await llm_classify_risk(text)
+    if risk.get("risk_score",0) >= RISK_ESCALATE_SCORE:
+        retrieval.cancel()
+        reply = ("I am concerned for your safety. Please contact emergency services. Would you like local resources?")
+        session_id = await run_in_threadpool(persist_chat_turn, db, turn, reply, risk["risk_score"], None, False, True)
+        return {"emergency": {"session_id": session_id, "reply": reply, "emergency": True, "metadata": risk}}
+    history = turn["history"]
+    with stage("retrieval_wait"):
+        retrieved = await retrieval
+    if RESPONSE_CACHE_ENABLED and cacheable_risk(risk) and not (history and (history["messages"] or history.get("summary"))):
+        with stage("response_cache"):
+            turn["cache"] = await lookup_cached_reply(text, retrieved, user)
+        if turn["cache"] and turn["cache"]["hit"]: return turn
+
+    # build system prompt; token counting runs in the threadpool in case the tokenizer is still loading
+    with stage("prompt_build"):
+        user_info = build_user_info(user)
+        turn.update(risk=risk, messages=await run_in_threadpool(build_chat_messages, text, user_info, retrieved, history))
+    return turn
+
+# with the provider circuit open there is no point waiting for it: answer at once
+DEGRADED_REPLY = ("I'm having trouble responding right now, please try again in a few minutes. "
+                  "If you are in immediate danger, please contact local emergency services now.")
+
+def degraded_response(db, turn: Dict) -> Dict:
+    session_id = persist_chat_turn(db, turn, DEGRADED_REPLY, None, None, False, True)
+    return {"session_id": session_id, "reply": DEGRADED_REPLY, "degraded": True, "metadata": {}}
 
-    resp = call_openrouter_chat(messages, max_tokens=512, temperature=0.3)
+# Chat endpoint
+@router.post("/chat")
+async def chat(payload: ChatIn = Body(...), authorization: Optional[str] = Header(None), db=Depends(get_db)):
+    # one time budget for every provider call this turn makes
+    with request_deadline():
+        return await chat_turn(payload, authorization, db)
+
+async def chat_turn(payload: ChatIn, authorization: Optional[str], db) -> Dict:
+    turn = await prepare_chat_turn(payload, authorization, db)
+    if "emergency" in turn: return turn["emergency"]
+    hit = (turn.get("cache") or {}).get("hit")
+    if hit:
+        clean, metadata = await run_in_threadpool(finish_cached_turn, db, turn, hit)
+        schedule_summary_refresh(turn["session_id"])
+        return {"session_id": turn["session_id"], "reply": clean, "metadata": metadata, "openrouter_raw": None, "cached": True}
+
+    try:
+        with stage("llm_chat"):
+            resp = await call_openrouter_chat(turn["messages"], max_tokens=512, temperature=0.3)
+    except ProviderUnavailable:
+        return await run_in_threadpool(degraded_response, db, turn)
+    except HTTPException:
+        # the user's message is already stored; keep the history cache in step
+        remember_turn(turn, None)
+        raise
     try:
         assistant_full = resp["choices"][0]["message"]["content"]
     except Exception:
         assistant_full = resp.get("choices",[{}])[0].get("text","")
-    clean, metadata = extract_trailing_json(assistant_full)
+    with stage("persist_turn"):
+        clean, metadata = await run_in_threadpool(finish_chat_turn, db, turn, assistant_full)
+    schedule_summary_refresh(turn["session_id"])
 
-    # save assistant message
-    am = Message(session_id=session.id, sender="assistant", text=clean, risk_score=int(metadata.get("risk_score", risk.get("risk_score",0))), emotion=metadata.get("emotion"))
-    db.add(am); db.commit(); db.refresh(am)
+    return {"session_id": turn["session_id"], "reply": clean, "metadata": metadata, "openrouter_raw": resp}
 
-    # create short report
-    rep = Report(user_id=(user.id if user else None), session_id=session.id, summary=(clean[:200] + "..."), risk_score=am.risk_score, psychologist_id=(user.psychologist_id if user else None))
-    db.add(rep); db.commit()
+# Streaming chat endpoint (Server-Sent Events)
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
 
-    return {"session_id": session.id, "reply": clean, "metadata": metadata, "openrouter_raw": resp}
+def persist_streamed_turn(turn: Dict, assistant_full: Optional[str], hit: Optional[Dict] = None, degraded: bool = False,
+                          partial: bool = False):
+    # the request-scoped session may already be closed once the body is streaming
+    db = SessionLocal()
+    try:
+        if degraded:
+            return degraded_response(db, turn)
+        if partial:
+            # the client hung up mid-reply: keep what was generated, never cache it
+            clean = extract_trailing_json(assistant_full)[0] if assistant_full else ""
+            return persist_chat_turn(db, turn, clean or None, turn["risk"].get("risk_score"), None, False, True)
+        if hit is not None:
+            return finish_cached_turn(db, turn, hit)
+        if assistant_full is None:
+            return persist_chat_turn(db, turn)
+        return finish_chat_turn(db, turn, assistant_full)
+    finally:
+        db.close()
+
+async def chat_event_stream(turn: Dict):
+    # `delta` events carry raw model text (including the trailing JSON); the final
+    # `done` event carries the cleaned reply and metadata, like the /chat response.
+    hit = (turn.get("cache") or {}).get("hit")
+    if hit:
+        clean, metadata = await run_in_threadpool(persist_streamed_turn, turn, None, hit)
+        schedule_summary_refresh(turn["session_id"])
+        yield sse_event({"session_id": turn["session_id"], "reply": clean, "metadata": metadata, "cached": True}, event="done")
+        return
+    parts = []
+    settled = False  # set once one of the normal endings has taken over persisting
+    start = time.perf_counter()
+    try:
+        try:
+            with request_deadline(at=turn["deadline"]):
+                async for delta in stream_openrouter_chat(turn["messages"], max_tokens=512, temperature=0.3):
+                    if not parts: STAGE_SECONDS.observe(time.perf_counter() - start, "llm_first_token")
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+        except ProviderUnavailable:
+            settled = True
+            response = await run_in_threadpool(persist_streamed_turn, turn, None, None, True)
+            yield sse_event(response, event="done")
+            return
+        except HTTPException as e:
+            settled = True
+            # the client already shows the deltas it got: keep them like a disconnect does
+            session_id = await run_in_threadpool(persist_streamed_turn, turn, "".join(parts) or None, None, False, bool(parts))
+            yield sse_event({"session_id": session_id, "detail": e.detail}, event="error")
+            return
+        settled = True
+        clean, metadata = await run_in_threadpool(persist_streamed_turn, turn, "".join(parts))
+        schedule_summary_refresh(turn["session_id"])
+        yield sse_event({"session_id": turn["session_id"], "reply": clean, "metadata": metadata}, event="done")
+    finally:
+        if not settled:
+            # disconnect (cancellation or aclose): the cancel scope would abort a plain await
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(persist_streamed_turn, turn, "".join(parts), None, False, True)
+
+@router.post("/chat/stream")
+async def chat_stream(payload: ChatIn = Body(...), authorization: Optional[str] = Header(None), db=Depends(get_db)):
+    # the body streams after this returns, so the deadline travels with the turn
+    with request_deadline() as deadline:
+        turn = await prepare_chat_turn(payload, authorization, db)
+    turn["deadline"] = deadline
+    if "emergency" in turn:
+        events = iter([sse_event(turn["emergency"], event="done")])
+    else:
+        events = chat_event_stream(turn)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # End session - summarize and email
-@app.post("/end_session")
-def end_session(body: Dict = Body(...), authorization: Optional[str] = Header(None), db=Depends(get_db)):
-    token = None; user = None
-    if authorization:
-        try:
-            token = authorization.split(" ")[1]; user = get_user_from_token(token, db)
-        except Exception:
-            user = None
+def save_session_report(db, session_id: int, user, summary_json: Dict) -> bool:
+    """Save the report, end the session and queue the psychologist's email in one
+    transaction; the dispatcher renders and sends it. Returns whether one was queued."""
+    psych = user.psychologist if user else None
+    with unit_of_work(db):
+        rep = Report(user_id=(user.id if user else None), session_id=session_id, summary=summary_json.get("summary",""), risk_score=int(summary_json.get("risk_score",0)), urgency=summary_json.get("urgency"), psychologist_id=(user.psychologist_id if user else None))
+        db.add(rep)
+        db.query(Session).filter(Session.id == session_id).update({"status": "ended", "ended_at": datetime.utcnow()}, synchronize_session=False)
+        if psych and psych["email"]:
+            queue_email(db, psych["email"], f"Mental Assessment Report for {user.first_name} {user.last_name}", report=rep)
+    return bool(psych and psych["email"])
+
+@router.post("/end_session")
+async def end_session(body: Dict = Body(...), authorization: Optional[str] = Header(None), db=Depends(get_db)):
+    user = await auth_user_or_none(authorization, db)
     session_id = body.get("session_id")
     if session_id is None:
         raise HTTPException(status_code=400, detail="session_id required")
-    msgs = db.query(Message).filter(Message.session_id==int(session_id)).order_by(Message.created_at.asc()).all()
-    convo = "\n\n".join([f"{m.sender}: {m.text}" for m in msgs])
-    system = ("You are Mental health Assessment summarizer. Return ONLY JSON: {\"summary\":\"...\",\"risk_score\":int,\"urgency\":\"high|moderate|normal\"}")
-    messages = [{"role":"system","content":system}, {"role":"user","content":f"Conversation:\n\n{convo}\n\nReturn JSON."}]
-    resp = call_openrouter_chat(messages, max_tokens=400, temperature=0.0)
-    assistant_text = resp["choices"][0]["message"]["content"]
-    s = assistant_text.find("{"); e = assistant_text.rfind("}")
-    summary_json = {}
-    if s != -1 and e != -1 and e > s:
-        try:
-            summary_json = json.loads(assistant_text[s:e+1])
-        except Exception:
-            summary_json = {"summary": assistant_text, "risk_score":0, "urgency":"normal"}
-    else:
-        summary_json = {"summary": assistant_text, "risk_score":0, "urgency":"normal"}
-
-    # save report
-    rep = Report(user_id=(user.id if user else None), session_id=int(session_id), summary=summary_json.get("summary",""), risk_score=int(summary_json.get("risk_score",0)), psychologist_id=(user.psychologist_id if user else None))
-    db.add(rep); db.commit()
-
-    # email psychologist if assigned
-    sent = False
-    if user and user.psychologist_id:
-        psych = db.query(Psychologist).get(user.psychologist_id)
-        if psych and psych.email:
-            subj = f"Mental Assessment Report for {user.first_name} {user.last_name}"
-            body_text = (f"Patient: {user.first_name} {user.last_name}\nEmail: {user.email}\n\nSummary:\n{summary_json.get('summary')}\n\nUrgency: {summary_json.get('urgency')}\nRisk Score: {summary_json.get('risk_score')}\n\nFull conversation:\n{convo}")
-            sent = send_email(psych.email, subj, body_text)
-
-    return {"ok": True, "report": summary_json, "email_sent": sent}
+    # finalize: only the messages since the last rolling update go to the LLM
+    with stage("session_summary"):
+        summary_json = await update_session_summary(int(session_id))
+    if summary_json is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # never report less than the worst turn we scored
+    summary_json["risk_score"] = max(int(summary_json.get("risk_score", 0) or 0), summary_json["risk_max"])
+
+    # save report and queue the email to the psychologist if assigned; delivery is
+    # off the request path (mailer.py)
+    with stage("report_save"):
+        queued = await run_in_threadpool(save_session_report, db, int(session_id), user, summary_json)
+    if queued: email_dispatcher.notify()
+
+    return {"ok": True, "report": summary_json, "email_queued": queued}
 
 # Utility endpoints
-@app.get("/sessions/{session_id}/messages")
-def get_session_messages(session_id: int, db=Depends(get_db)):
-    msgs = db.query(Message).filter(Message.session_id==session_id).order_by(Message.created_at.asc()).all()
-    return {"session_id": session_id, "messages":[{"id":m.id,"sender":m.sender,"text":m.text,"risk_score":m.risk_score,"emotion":m.emotion,"created_at":m.created_at.isoformat()} for m in msgs]}
-
-@app.get("/me")
+DEFAULT_MESSAGE_FIELDS = ["id", "sender", "text", "risk_score", "emotion", "created_at"]
+
+@router.get("/sessions/{session_id}/messages")
+def get_session_messages(session_id: int, limit: int = Query(100, ge=1, le=1000), cursor: Optional[str] = None,
+                         fields: Optional[str] = None, db=Depends(get_db)):
+    # pass the returned next_cursor back as `cursor` for the following page
+    return message_page(db, session_id, limit, cursor, parse_fields(fields, DEFAULT_MESSAGE_FIELDS))
+
+@router.get("/export/messages")
+def export_messages(session_ids: Optional[str] = None, user_id: Optional[int] = None, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+                    fields: Optional[str] = None, authorization: Optional[str] = Header(None), db=Depends(get_db)):
+    # e.g. ?session_ids=1,2,3&fields=session_id,sender,created_at to leave out message text;
+    # callers only ever get their own sessions
+    user = require_user(authorization, db)
+    if user_id is not None and user_id != user.id: raise HTTPException(status_code=403, detail="Not allowed")
+    ids = None
+    if session_ids:
+        try:
+            ids = [int(x) for x in session_ids.split(",") if x.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="session_ids must be integers")
+    cols = parse_fields(fields, MESSAGE_FIELDS)
+    rows = iter_export_rows(ids, user.id, since, until, cols)
+    if format == "csv":
+        return StreamingResponse(csv_lines(rows, cols), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=messages.csv"})
+    return StreamingResponse(ndjson_lines(rows), media_type="application/x-ndjson")
+
+def require_user(authorization: Optional[str], db):
+    if not authorization or " " not in authorization: raise HTTPException(status_code=401, detail="Authorization required")
+    return get_user_from_token(authorization.split(" ")[1], db)
+
+@router.get("/me")
 def me(authorization: Optional[str] = Header(None), db=Depends(get_db)):
-    if not authorization: raise HTTPException(status_code=401, detail="Authorization required")
-    token = authorization.split(" ")[1]; user = get_user_from_token(token, db)
-    return {"id": user.id, "first_name": user.first_name, "last_name": user.last_name, "email": user.email, "psychologist_id": user.psychologist_id}
+    user = require_user(authorization, db)
+    return {"id": user.id, "first_name": user.first_name, "last_name": user.last_name, "email": user.email, "psychologist_id": user.psychologist_id,
+            "psychologist": user.psychologist}
 
-@app.get("/")
+@router.get("/")
 def root():
-    return {"service":"Backend","endpoints":["/register","/login","/index_ppt","/chat","/end_session","/sessions/{id}/messages"]}
-
-# Startup load index
-@app.on_event("startup")
-def startup_event():
-    if faiss is not None:
-        load_faiss_index()
+    return {"service":"Backend","endpoints":["/register","/login","/index_ppt","/chat","/chat/stream","/end_session","/sessions/{id}/messages","/export/messages"]}
+
+# App factory
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timer = StartupTimer(IMPORT_STARTED)
+    if DB_AUTO_MIGRATE:
+        from migrate import migrate
+        with timer.stage("migrate"): await asyncio.to_thread(migrate)
+    if RAG_ENABLED and faiss is not None:
+        # readiness doesn't wait for the index: retrieval returns nothing until it's in
+        app.state.index_loader = asyncio.create_task(asyncio.to_thread(load_faiss_index))
+    # same for the tokenizer: its BPE file may need a download, which must not stall a request
+    app.state.tokenizer_loader = asyncio.create_task(asyncio.to_thread(get_encoding))
+    with timer.stage("email_dispatcher"): email_dispatcher.start()
+    if PROFILER_ENABLED: PROFILER.start()
+    app.state.cold_start = timer.report()
+    timer.log()
+    yield
+    await close_client()
+    await asyncio.to_thread(write_behind.flush)
+    await asyncio.to_thread(email_dispatcher.stop)
+    PROFILER.stop()
+    shutdown_pool()
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="Mental Health AI Assistant Backend (Int IDs)", lifespan=lifespan)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    if METRICS_ENABLED: app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
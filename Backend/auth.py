@@ -0,0 +1,134 @@
+"""JWT helpers and per-process caches for authenticated requests.
+
+Decoded tokens and user profiles (the user row plus the assigned psychologist) are
+kept in bounded TTL caches, so an authenticated request costs one DB lookup per
+user per AUTH_CACHE_TTL instead of one per request. Handlers that change a user
+call `invalidate_user`; other workers see the change once their entry expires.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from jose import JWTError
+
+from coldstart import lazy_import
+from models import User, Psychologist
+
+jwt = lazy_import("jose.jwt")
+
+load_dotenv()
+
+# CONFIG
+JWT_SECRET = os.getenv("JWT_SECRET", "change_this_super_secret")
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60*24*7
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+
+class TTLCache:
+    """Bounded LRU whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_items: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None: del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key); self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + min(self.ttl, ttl if ttl is not None else self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items: self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"items": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0}
+
+class UserProfile:
+    """What request handlers need from a user, detached from any DB session."""
+
+    __slots__ = ("id", "first_name", "last_name", "email", "age_group", "psychologist_id", "psychologist")
+
+    def __init__(self, user: User, psychologist: Optional[Psychologist] = None):
+        self.id = user.id
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.email = user.email
+        self.age_group = user.age_group
+        self.psychologist_id = user.psychologist_id
+        self.psychologist = {"id": psychologist.id, "name": psychologist.name, "email": psychologist.email} if psychologist else None
+
+TOKEN_CACHE = TTLCache()
+PROFILE_CACHE = TTLCache()
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def decode_token(token: str) -> Dict:
+    payload = TOKEN_CACHE.get(token)
+    if payload is not None: return payload
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError as e:
+        raise HTTPException(status_code=401, detail="Invalid token") from e
+    # never serve a token from cache past its own expiry
+    exp = payload.get("exp")
+    TOKEN_CACHE.put(token, payload, (exp - time.time()) if exp else None)
+    return payload
+
+def token_user_id(token: str) -> int:
+    sub = decode_token(token).get("sub")
+    if not sub:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+    return int(sub)
+
+def load_profile(db, user_id: int) -> Optional[UserProfile]:
+    # user and psychologist in one round trip
+    row = (db.query(User, Psychologist).outerjoin(Psychologist, Psychologist.id == User.psychologist_id)
+           .filter(User.id == user_id).first())
+    if row is None: return None
+    profile = UserProfile(*row)
+    PROFILE_CACHE.put(user_id, profile)
+    return profile
+
+def cached_user(token: str) -> Optional[UserProfile]:
+    """The profile if token and user are both cached, else None (no DB access)."""
+    return PROFILE_CACHE.get(token_user_id(token))
+
+def get_user_from_token(token: str, db) -> UserProfile:
+    user_id = token_user_id(token)
+    user = PROFILE_CACHE.get(user_id) or load_profile(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+def invalidate_user(user_id: int):
+    PROFILE_CACHE.pop(user_id)
+
+def auth_stats() -> Dict:
+    return {"tokens": TOKEN_CACHE.stats(), "profiles": PROFILE_CACHE.stats(), "ttl_s": AUTH_CACHE_TTL}
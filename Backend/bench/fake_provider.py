@@ -0,0 +1,135 @@
+"""Local stand-in for the OpenRouter API, with injectable latency and failures.
+
+Serves /chat/completions (plain and `stream: true`) and /embeddings under /api/v1
+with canned but well-formed answers, so the backend runs end to end without a key:
+
+    cd Backend
+    python -m bench.fake_provider --port 9100 --latency-ms 300 --slow-rate 0.05 --slow-ms 8000
+    python -m bench.fake_provider --ttft-ms 400 --tokens-per-s 40 --reply-tokens 250   # paced like a real model
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/api/v1 OPENROUTER_API_KEY=x uvicorn app:app
+
+Knobs can be changed while it runs (e.g. to start a brownout mid-test) with
+POST /_config {"error_rate": 1.0}; GET /_stats returns what it has served.
+
+With tokens_per_s > 0 completions are paced by token rate (streamed chunks and the
+total time of non-streaming calls) after ttft_ms; otherwise chunks are chunk_ms
+apart. reply_tokens > 0 pads chat replies to roughly that many tokens.
+slow_first_n makes the next n requests take slow_ms, for a deterministic straggler.
+"""
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+from typing import Dict
+
+import numpy as np
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CONFIG: Dict = {"latency_ms": 50.0, "jitter_ms": 20.0, "slow_rate": 0.0, "slow_ms": 5000.0, "error_rate": 0.0,
+                "error_status": 503, "slow_first_n": 0, "embed_dim": 1536, "stream_chunks": 8, "chunk_ms": 20.0,
+                "ttft_ms": 0.0, "tokens_per_s": 0.0, "reply_tokens": 0, "embed_ms_per_input": 0.0}
+STATS: Dict = {"chat": 0, "chat_stream": 0, "embeddings": 0, "errors": 0, "slow": 0,
+               "prompt_tokens": 0, "completion_tokens": 0, "embedded_inputs": 0}
+
+app = FastAPI(title="Fake OpenRouter")
+
+REPLY = ("Thank you for sharing that. It sounds like things have been heavy lately. "
+         "Could you tell me a bit more about when you notice these feelings most?")
+
+async def injected_delay(extra_ms: float = 0.0):
+    delay = CONFIG["latency_ms"] + extra_ms + random.uniform(-1, 1) * CONFIG["jitter_ms"]
+    if CONFIG["slow_first_n"] > 0 or random.random() < CONFIG["slow_rate"]:
+        CONFIG["slow_first_n"] = max(CONFIG["slow_first_n"] - 1, 0)
+        delay = CONFIG["slow_ms"]; STATS["slow"] += 1
+    await asyncio.sleep(max(delay, 0) / 1000.0)
+
+def injected_error():
+    if random.random() < CONFIG["error_rate"]:
+        STATS["errors"] += 1
+        return JSONResponse({"error": {"message": "injected failure"}}, status_code=CONFIG["error_status"])
+    return None
+
+def completion_text(body: Dict) -> str:
+    system = (body.get("messages") or [{}])[0].get("content", "")
+    if "safety classifier" in system:
+        return '{"risk_score": 12, "label": "low", "reason": "no risk indicators"}'
+    if "summarizer" in system:
+        return '{"summary": "The user talked about stress at work and poor sleep.", "risk_score": 15, "urgency": "normal"}'
+    reply = REPLY
+    while CONFIG["reply_tokens"] and len(reply) // 4 < CONFIG["reply_tokens"]: reply += " " + REPLY
+    return reply + ' {"risk_score": 10, "emotion": "anxious", "confidence": 0.8}'
+
+def usage(body: Dict, text: str) -> Dict:
+    prompt = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+    STATS["prompt_tokens"] += prompt; STATS["completion_tokens"] += len(text) // 4
+    return {"prompt_tokens": prompt, "completion_tokens": len(text) // 4, "total_tokens": prompt + len(text) // 4}
+
+def generation_ms(text: str) -> float:
+    # ~4 characters per token, like usage() counts them
+    return 1000.0 * (len(text) / 4) / CONFIG["tokens_per_s"] if CONFIG["tokens_per_s"] > 0 else 0.0
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(body: Dict = Body(...)):
+    text = completion_text(body)
+    streaming = bool(body.get("stream"))
+    await injected_delay(CONFIG["ttft_ms"] + (0.0 if streaming else generation_ms(text)))
+    error = injected_error()
+    if error is not None: return error
+    if not streaming:
+        STATS["chat"] += 1
+        return {"id": "fake", "model": body.get("model"), "usage": usage(body, text),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+    STATS["chat_stream"] += 1
+    n = max(1, CONFIG["stream_chunks"]); step = -(-len(text) // n)
+    async def events():
+        yield ": OPENROUTER PROCESSING\n\n"
+        for i in range(0, len(text), step):
+            chunk_ms = generation_ms(text[i:i+step]) if CONFIG["tokens_per_s"] > 0 else CONFIG["chunk_ms"]
+            await asyncio.sleep(chunk_ms / 1000.0)
+            yield f'data: {json.dumps({"choices": [{"delta": {"content": text[i:i+step]}}]})}\n\n'
+        yield f'data: {json.dumps({"choices": [{"delta": {}}], "usage": usage(body, text)})}\n\n'
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def fake_embedding(text: str, dim: int) -> list:
+    # deterministic per text, so the backend's caches behave as they would for real
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    v = rng.standard_normal(dim).astype("float32")
+    return (v / np.linalg.norm(v)).round(6).tolist()
+
+@app.post("/api/v1/embeddings")
+async def embeddings(body: Dict = Body(...)):
+    texts = body.get("input") or []
+    if isinstance(texts, str): texts = [texts]
+    await injected_delay(CONFIG["embed_ms_per_input"] * len(texts))
+    error = injected_error()
+    if error is not None: return error
+    STATS["embeddings"] += 1; STATS["embedded_inputs"] += len(texts)
+    return {"model": body.get("model"), "usage": {"prompt_tokens": sum(len(t) for t in texts) // 4},
+            "data": [{"index": i, "embedding": fake_embedding(t, CONFIG["embed_dim"])} for i, t in enumerate(texts)]}
+
+@app.post("/_config")
+def set_config(changes: Dict = Body(...)):
+    CONFIG.update({k: v for k, v in changes.items() if k in CONFIG})
+    return CONFIG
+
+@app.get("/_stats")
+def stats():
+    return {**STATS, "config": CONFIG, "time": time.time()}
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake OpenRouter API for local load tests.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    for key, value in CONFIG.items():
+        ap.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    args = ap.parse_args()
+    CONFIG.update({k: getattr(args, k) for k in CONFIG})
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Synthetic users, sessions and messages for load tests.
+
+Writes straight into DATABASE_URL (migrating it first) at roughly production shape:
+session counts per user are Poisson, conversation lengths log-normal with a long
+tail, risk scores mostly low with a few spikes, timestamps spread over --days.
+About --active-share of the sessions are left open with no rolling summary, the
+worst case for /end_session. Also writes markdown documents for the /index_ppt
+scenario and a manifest the load driver reads:
+
+    cd Backend
+    DATABASE_URL=sqlite:///./bench.db python -m bench.fixtures --users 2000 --out bench_fixtures.json
+    RAG_SOURCES=./bench_docs DATABASE_URL=sqlite:///./bench.db uvicorn app:app
+
+Every user shares the password given by --password, so it is hashed only once.
+"""
+import os
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Dict
+
+from sqlalchemy import func, select, update
+
+from db import SessionLocal, engine
+from migrate import migrate
+from models import User, Psychologist, Session, Message
+
+FIRST_NAMES = ["Amara", "Ben", "Chen", "Dina", "Elif", "Farid", "Grace", "Hugo", "Ines", "Jonas", "Kemi", "Luca",
+               "Maya", "Nikhil", "Olga", "Pedro", "Quinn", "Rosa", "Sami", "Tara", "Umar", "Vera", "Wei", "Yara", "Zoe"]
+LAST_NAMES = ["Adeyemi", "Becker", "Costa", "Dubois", "Eriksen", "Fischer", "Garcia", "Haddad", "Ivanova", "Jensen",
+              "Kowalski", "Lopez", "Moreau", "Nakamura", "Okafor", "Petrov", "Rossi", "Silva", "Tanaka", "Wagner"]
+AGE_GROUPS = ["13-17", "18-24", "25-34", "35-44", "45-54", "55+"]
+
+USER_LINES = ["I have been feeling really stressed about work lately.", "I can't sleep well, I keep waking up at 3am.",
+              "My exams are coming up and I feel overwhelmed.", "I had an argument with my partner again.",
+              "Some days I just don't feel like getting out of bed.", "I think I am doing a bit better this week.",
+              "I keep worrying about things I can't control.", "My manager keeps adding tasks and I can't say no.",
+              "I feel lonely since I moved to a new city.", "Breathing exercises helped a little yesterday.",
+              "I get anxious before every meeting.", "I have been skipping meals because I'm not hungry.",
+              "My family doesn't really understand what I'm going through.", "Thanks, that actually makes sense."]
+ASSISTANT_LINES = ["That sounds exhausting. What part of it weighs on you the most?",
+                   "It makes sense that you feel this way given everything going on.",
+                   "Would it help to try a short grounding exercise together?",
+                   "How have you been sleeping over the past week?",
+                   "It's good that you noticed that. What helped you in that moment?",
+                   "Could you tell me a bit more about when these feelings started?",
+                   "Talking to someone you trust can help. Is there anyone you feel close to?"]
+EMOTIONS = ["anxious", "sad", "calm", "stressed", "hopeful", "frustrated", "tired"]
+
+DOC_TOPICS = ["Sleep hygiene", "Grounding techniques", "Managing exam stress", "Work-life balance", "Loneliness",
+              "Breathing exercises", "Recognising burnout", "Talking to family", "Panic attacks", "Building routines"]
+
+def risk_score(rng: random.Random) -> int:
+    # mostly low, a long thin tail of concerning messages
+    r = rng.random()
+    if r < 0.85: return rng.randint(0, 20)
+    if r < 0.98: return rng.randint(20, 60)
+    return rng.randint(60, 95)
+
+def poisson(rng: random.Random, mean: float) -> int:
+    # Knuth; fine for the small means used here
+    limit, k, p = pow(2.718281828459045, -mean), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit: return k
+        k += 1
+
+def conversation_length(rng: random.Random, median: float, cap: int) -> int:
+    return max(2, min(cap, int(rng.lognormvariate(0, 0.8) * median)))
+
+def password_hash(password: str) -> str:
+    from passwords import _hash
+    return _hash(password)
+
+def make_users(db, n: int, password: str, psych_share: float, rng: random.Random, tag: str) -> List[Dict]:
+    psychs = [Psychologist(name=f"Dr. {rng.choice(LAST_NAMES)}", email=f"psych{i}.{tag}@bench.local")
+              for i in range(max(1, n // 50))]
+    db.add_all(psychs); db.flush()
+    hashed = password_hash(password)
+    users = []
+    for i in range(n):
+        users.append(User(first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), email=f"user{i}.{tag}@bench.local",
+                          age_group=rng.choice(AGE_GROUPS), password_hash=hashed,
+                          psychologist_id=(rng.choice(psychs).id if rng.random() < psych_share else None)))
+    db.add_all(users); db.flush()
+    return [{"id": u.id, "email": u.email} for u in users]
+
+def make_sessions(db, users: List[Dict], args, rng: random.Random):
+    """Returns ({"ended": [session ids], "active": [...]}, number of messages)."""
+    now = datetime.utcnow()
+    out = {"ended": [], "active": []}
+    messages = []; written = 0
+    def flush_messages():
+        nonlocal written
+        if messages: db.execute(Message.__table__.insert(), messages); written += len(messages); messages.clear()
+    for u in users:
+        for _ in range(poisson(rng, args.sessions_per_user)):
+            started = now - timedelta(seconds=rng.uniform(0, args.days * 86400))
+            active = rng.random() < args.active_share
+            s = Session(user_id=u["id"], started_at=started, created_at=started, status=("active" if active else "ended"))
+            db.add(s); db.flush()
+            t = started
+            for i in range(conversation_length(rng, args.messages_per_session, args.max_messages)):
+                t += timedelta(seconds=rng.expovariate(1 / 40.0))
+                if i % 2 == 0:
+                    messages.append({"session_id": s.id, "sender": "user", "text": rng.choice(USER_LINES),
+                                     "risk_score": risk_score(rng), "emotion": None, "created_at": t})
+                else:
+                    # executemany needs the same keys in every row
+                    messages.append({"session_id": s.id, "sender": "assistant", "text": rng.choice(ASSISTANT_LINES),
+                                     "risk_score": None, "emotion": rng.choice(EMOTIONS), "created_at": t})
+            if not active:
+                s.ended_at = t
+                s.summary = "The user discussed stress, sleep and coping strategies."
+                s.summary_risk_score = 10; s.summary_urgency = "normal"
+            out["active" if active else "ended"].append(s.id)
+            if len(messages) >= args.batch: flush_messages()
+    flush_messages()
+    # ended sessions are fully summarized, active ones have their whole backlog pending
+    last_id = select(func.max(Message.id)).where(Message.session_id == Session.id).scalar_subquery()
+    if out["ended"]:
+        db.execute(update(Session).where(Session.id.between(out["ended"][0], out["ended"][-1]), Session.status == "ended")
+                   .values(summary_upto_id=last_id))
+    return out, written
+
+def write_docs(path: str, n: int, rng: random.Random) -> List[str]:
+    os.makedirs(path, exist_ok=True)
+    files = []
+    for i in range(n):
+        topic = DOC_TOPICS[i % len(DOC_TOPICS)]
+        paragraphs = [" ".join(rng.choice(ASSISTANT_LINES + USER_LINES) for _ in range(6)) for _ in range(12)]
+        name = os.path.join(path, f"{i:03d}_{topic.lower().replace(' ', '_')}.md")
+        with open(name, "w") as f:
+            f.write(f"# {topic}\n\n" + "\n\n".join(paragraphs) + "\n")
+        files.append(name)
+    return files
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--sessions-per-user", type=float, default=4.0, help="Poisson mean")
+    ap.add_argument("--messages-per-session", type=float, default=18.0, help="log-normal median")
+    ap.add_argument("--max-messages", type=int, default=400)
+    ap.add_argument("--active-share", type=float, default=0.2, help="share of sessions left open and unsummarized")
+    ap.add_argument("--psych-share", type=float, default=0.7, help="share of users with an assigned psychologist")
+    ap.add_argument("--days", type=float, default=90.0)
+    ap.add_argument("--password", default="bench-password")
+    ap.add_argument("--docs", type=int, default=20, help="markdown documents for /index_ppt")
+    ap.add_argument("--docs-dir", default="./bench_docs")
+    ap.add_argument("--batch", type=int, default=5000, help="messages per insert batch")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_fixtures.json", help="manifest for bench.load")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    tag = f"{args.seed}-{int(time.time())}"  # emails stay unique across repeated runs
+    migrate(engine)
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        users = make_users(db, args.users, args.password, args.psych_share, rng, tag)
+        sessions, n_messages = make_sessions(db, users, args, rng)
+        db.commit()
+    finally:
+        db.close()
+    docs = write_docs(args.docs_dir, args.docs, rng) if args.docs else []
+    manifest = {"password": args.password, "users": users, "sessions": sessions, "docs_dir": os.path.abspath(args.docs_dir),
+                "docs": len(docs), "seed": args.seed, "created_at": datetime.utcnow().isoformat()}
+    with open(args.out, "w") as f: json.dump(manifest, f)
+    print(json.dumps({"users": len(users), "sessions": sum(len(v) for v in sessions.values()), "active_sessions": len(sessions["active"]),
+                      "messages": n_messages,
+                      "docs": len(docs), "seconds": round(time.perf_counter() - t0, 2), "out": args.out}))
+
+if __name__ == "__main__":
+    main()
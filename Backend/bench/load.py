@@ -0,0 +1,165 @@
+"""Closed-loop load driver: throughput and p50/p95/p99 per endpoint, as JSON.
+
+Start the fake provider and the backend on fixture data (see bench.fake_provider
+and bench.fixtures), then:
+
+    cd Backend
+    python -m bench.load --base-url http://127.0.0.1:8000 --fixtures bench_fixtures.json \\
+        --concurrency 32 --duration 60 --warmup 10 --json before.json
+    # ... change something, restart, run again ...
+    python -m bench.load ... --json after.json --compare before.json --fail-on-regression 10
+
+Each of --concurrency virtual users loops over scenarios drawn from --mix until
+--duration runs out. Requests that start during --warmup are not counted. An
+endpoint's error count includes transport errors and any 5xx/429 response.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Optional, Dict, List
+
+import httpx
+import numpy as np
+
+from bench.scenarios import SCENARIOS, DEFAULT_MIX, VirtualUser, parse_mix
+
+class Recorder:
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started: Optional[float] = None
+
+    def __call__(self, label: str, seconds: float, status: int, error: Optional[str] = None):
+        now = time.perf_counter()
+        if now - seconds < self.warmup_until: return
+        if self.started is None: self.started = now - seconds
+        self.samples[label].append(seconds * 1000)
+        self.statuses[label][error or str(status)] += 1
+        if status == 0 or status == 429 or status >= 500: self.errors[label] += 1
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+def summarize(rec: Recorder, elapsed: float) -> Dict:
+    endpoints = {}
+    for label, samples in sorted(rec.samples.items()):
+        endpoints[label] = {"requests": len(samples), "errors": rec.errors[label],
+                            "error_rate": round(rec.errors[label] / len(samples), 4),
+                            "throughput_rps": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+                            "mean_ms": round(float(np.mean(samples)), 2), **percentiles(samples),
+                            "max_ms": round(float(np.max(samples)), 2), "statuses": dict(rec.statuses[label])}
+    total = sum(e["requests"] for e in endpoints.values())
+    return {"elapsed_s": round(elapsed, 2), "requests": total, "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+            "errors": sum(e["errors"] for e in endpoints.values()), "endpoints": endpoints}
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+async def fetch_json(client: httpx.AsyncClient, url: str) -> Optional[Dict]:
+    try:
+        resp = await client.get(url)
+        return resp.json() if resp.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+async def virtual_user(i: int, client: httpx.AsyncClient, fixtures: Dict, rec: Recorder, mix: Dict[str, float],
+                       deadline: float, seed: int, counts: Dict[str, int]):
+    rng = random.Random(seed * 100003 + i)
+    vu = VirtualUser(client, fixtures, rec, rng)
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        if time.perf_counter() >= rec.warmup_until: counts[name] += 1
+        try:
+            await SCENARIOS[name](vu)
+        except Exception as e:
+            # a broken scenario should show up in the report, not kill the run
+            rec(f"scenario_{name}", 0.0, 0, type(e).__name__)
+
+async def run(args) -> Dict:
+    with open(args.fixtures) as f:
+        fixtures = json.load(f)
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    counts: Dict[str, int] = defaultdict(int)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        rec = Recorder(start + args.warmup)
+        deadline = start + args.warmup + args.duration
+        await asyncio.gather(*[virtual_user(i, client, fixtures, rec, mix, deadline, args.seed, counts)
+                               for i in range(args.concurrency)])
+        elapsed = time.perf_counter() - (rec.started or start)
+        result = {"config": {"base_url": args.base_url, "concurrency": args.concurrency, "duration_s": args.duration,
+                             "warmup_s": args.warmup, "mix": mix, "seed": args.seed, "users": len(fixtures["users"]),
+                             "revision": git_revision(), "label": args.label},
+                  **summarize(rec, elapsed), "scenarios": dict(counts)}
+        if args.provider_url: result["provider"] = await fetch_json(client, args.provider_url.rstrip("/") + "/_stats")
+        if args.server_stats: result["server"] = {p: await fetch_json(client, p) for p in ("/provider_stats", "/risk_stats")}
+    return result
+
+def compare(current: Dict, baseline: Dict, threshold_pct: float) -> List[Dict]:
+    """Per endpoint change in latency percentiles and throughput; a regression is a
+    latency increase (or throughput drop) of more than threshold_pct. Throughput is
+    only judged when both runs used the same mix and concurrency."""
+    rows = []
+    same_load = all(current["config"].get(k) == baseline.get("config", {}).get(k) for k in ("mix", "concurrency"))
+    for label, cur in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(label)
+        if not base: continue
+        row = {"endpoint": label}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "error_rate"):
+            row[key] = {"before": base[key], "after": cur[key],
+                        "change_pct": round(100.0 * (cur[key] - base[key]) / base[key], 1) if base[key] else None}
+        worse = [k for k in ("p50_ms", "p95_ms", "p99_ms") if (row[k]["change_pct"] or 0) > threshold_pct]
+        if same_load and (row["throughput_rps"]["change_pct"] or 0) < -threshold_pct: worse.append("throughput_rps")
+        if cur["error_rate"] > base["error_rate"] + 0.01: worse.append("error_rate")
+        row["regressed"] = worse
+        rows.append(row)
+    return rows
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--fixtures", default="bench_fixtures.json", help="manifest written by bench.fixtures")
+    ap.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=5.0, help="seconds before measuring starts")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights, scenarios: {', '.join(SCENARIOS)}")
+    ap.add_argument("--timeout", type=float, default=60.0, help="per request, seconds")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--label", help="free-form tag stored with the results")
+    ap.add_argument("--provider-url", help="fake provider base URL, to include its /_stats")
+    ap.add_argument("--server-stats", action="store_true", help="include the backend's /provider_stats and /risk_stats")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="baseline results to compare against")
+    ap.add_argument("--fail-on-regression", type=float, metavar="PCT",
+                    help="exit 1 if any endpoint regressed by more than PCT percent (needs --compare)")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    regressed = False
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        threshold = args.fail_on_regression if args.fail_on_regression is not None else 10.0
+        result["comparison"] = {"baseline": args.compare, "threshold_pct": threshold,
+                                "endpoints": compare(result, baseline, threshold)}
+        regressed = any(r["regressed"] for r in result["comparison"]["endpoints"])
+    if args.json:
+        with open(args.json, "w") as f: json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    if regressed and args.fail_on_regression is not None: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Scripted user journeys for the load driver (bench.load).
+
+Each scenario is an async function of a VirtualUser and issues a realistic
+sequence of requests; every request is timed under an endpoint label, which is
+what the driver reports p50/p95/p99 for. Pick the mix with --mix, e.g.
+`--mix conversation=6,stream=2,history=3,end_backlog=1,login=1,index=0`.
+"""
+import os
+import time
+import asyncio
+import random
+from typing import Optional, Dict, Callable
+
+import httpx
+
+OPENERS = ["I have been feeling really stressed about work lately.", "I can't sleep and I'm exhausted all the time.",
+           "My exams start next week and I can't focus.", "I feel lonely since moving here.",
+           "I keep overthinking everything my friends say.", "I've been arguing with my parents a lot."]
+FOLLOW_UPS = ["It mostly happens in the evenings.", "I tried going for walks but it didn't help much.",
+              "Maybe it started when I changed jobs.", "I don't really have anyone to talk to about it.",
+              "That makes sense, what else could I try?", "Sometimes it gets better on weekends."]
+
+IDLE_SECONDS = 1.0  # think time when a scenario has nothing left to do
+
+class VirtualUser:
+    """One simulated client: its own identity, session and random stream."""
+
+    def __init__(self, client: httpx.AsyncClient, fixtures: Dict, record: Callable, rng: random.Random):
+        self.client = client
+        self.fixtures = fixtures
+        self.record = record
+        self.rng = rng
+        self.token: Optional[str] = None
+
+    async def request(self, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.record(label, time.perf_counter() - t0, 0, type(e).__name__)
+            return None
+        self.record(label, time.perf_counter() - t0, resp.status_code)
+        return resp
+
+    async def login(self) -> Optional[str]:
+        user = self.rng.choice(self.fixtures["users"])
+        resp = await self.request("login", "POST", "/login", json={"email": user["email"], "password": self.fixtures["password"]})
+        if resp is not None and resp.status_code == 200:
+            self.token = resp.json()["access_token"]
+        return self.token
+
+    async def headers(self) -> Dict:
+        if self.token is None: await self.login()
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+async def idle(vu: VirtualUser):
+    # returning without awaiting would spin the driver's event loop and skew every latency
+    await asyncio.sleep(IDLE_SECONDS * (0.5 + vu.rng.random()))
+
+async def conversation(vu: VirtualUser):
+    # a new session: a few turns, then end it (the rolling summary makes this cheap)
+    headers = await vu.headers()
+    session_id = None
+    for i in range(vu.rng.randint(2, 5)):
+        text = vu.rng.choice(OPENERS if i == 0 else FOLLOW_UPS)
+        resp = await vu.request("chat", "POST", "/chat", json={"message": text, "session_id": session_id}, headers=headers)
+        if resp is None or resp.status_code != 200: return
+        session_id = resp.json().get("session_id")
+    await vu.request("end_session", "POST", "/end_session", json={"session_id": session_id}, headers=headers)
+
+async def stream(vu: VirtualUser):
+    # one streamed turn; time to first token is reported separately from the full reply
+    headers = await vu.headers()
+    t0 = time.perf_counter(); status = 0; first = None
+    try:
+        async with vu.client.stream("POST", "/chat/stream", json={"message": vu.rng.choice(OPENERS)}, headers=headers) as resp:
+            status = resp.status_code
+            async for line in resp.aiter_lines():
+                if first is None and line.startswith("data:"):
+                    first = time.perf_counter() - t0
+                    vu.record("chat_stream_first_token", first, status)
+    except httpx.HTTPError as e:
+        vu.record("chat_stream", time.perf_counter() - t0, 0, type(e).__name__)
+        return
+    vu.record("chat_stream", time.perf_counter() - t0, status)
+
+async def history(vu: VirtualUser):
+    # read back an old session page by page, like the history view does
+    sessions = vu.fixtures["sessions"]["ended"] or vu.fixtures["sessions"]["active"]
+    if not sessions: return await idle(vu)
+    session_id = vu.rng.choice(sessions)
+    cursor = None
+    for _ in range(vu.rng.randint(1, 3)):
+        params = {"limit": 50, **({"cursor": cursor} if cursor else {})}
+        resp = await vu.request("history", "GET", f"/sessions/{session_id}/messages", params=params)
+        if resp is None or resp.status_code != 200: return
+        cursor = resp.json().get("next_cursor")
+        if not cursor: return
+
+async def end_backlog(vu: VirtualUser):
+    # ending a long unsummarized session: the worst case for /end_session; each
+    # fixture session is ended once, after that the scenario is a no-op
+    active = vu.fixtures["sessions"]["active"]
+    if not active: return await idle(vu)
+    session_id = active.pop(vu.rng.randrange(len(active)))
+    await vu.request("end_session_backlog", "POST", "/end_session", json={"session_id": session_id}, headers=await vu.headers())
+
+async def login(vu: VirtualUser):
+    await vu.login()
+
+async def me(vu: VirtualUser):
+    await vu.request("me", "GET", "/me", headers=await vu.headers())
+
+async def index(vu: VirtualUser):
+    # re-index after one fixture document changed (the sync is incremental), when the
+    # docs are on this machine; otherwise this measures the nothing-changed path
+    docs_dir = vu.fixtures.get("docs_dir")
+    if docs_dir and os.path.isdir(docs_dir):
+        names = sorted(os.listdir(docs_dir))
+        if names:
+            with open(os.path.join(docs_dir, vu.rng.choice(names)), "a") as f:
+                f.write("\n" + vu.rng.choice(FOLLOW_UPS) + "\n")
+    await vu.request("index_ppt", "POST", "/index_ppt")
+
+SCENARIOS: Dict[str, Callable] = {"conversation": conversation, "stream": stream, "history": history,
+                                  "end_backlog": end_backlog, "login": login, "me": me, "index": index}
+DEFAULT_MIX = "conversation=6,stream=2,history=3,end_backlog=1,login=1,me=1,index=0"
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        if not part.strip(): continue
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    weights = {k: v for k, v in weights.items() if v > 0}
+    if not weights: raise ValueError("Empty scenario mix")
+    return weights
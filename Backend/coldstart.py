@@ -0,0 +1,124 @@
+"""Cold-start helpers: deferred imports, startup stage timing and an import report.
+
+`lazy_import` returns a module whose code only runs on first attribute access
+(importlib's LazyLoader), or None when the package is not installed, so optional
+heavy dependencies (faiss, python-pptx, python-jose, passlib) cost nothing until a
+request actually needs them.
+
+    cd Backend
+    python coldstart.py                  # import + lifespan startup report
+    python coldstart.py --json cold.json --top 20
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+import importlib.util
+from contextlib import contextmanager
+from typing import Optional, List, Dict
+
+logger = logging.getLogger("medisos")
+
+# modules whose presence at import time is worth flagging
+HEAVY_MODULES = ["faiss", "pptx", "tiktoken", "jose.jwt", "passlib.context", "sentence_transformers", "torch", "numpy", "sqlalchemy"]
+
+def lazy_import(name: str):
+    if name in sys.modules: return sys.modules[name]
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.loader is None: return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+class StartupTimer:
+    """Times named lifespan stages and logs one line once the app is ready."""
+
+    def __init__(self, import_started: Optional[float] = None):
+        self.import_started = import_started
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def report(self) -> Dict:
+        out = {"startup_s": round(time.perf_counter() - self.started, 4),
+               "stages_s": {k: round(v, 4) for k, v in self.stages.items()}}
+        if self.import_started is not None: out["import_s"] = round(self.started - self.import_started, 4)
+        return out
+
+    def log(self):
+        r = self.report()
+        stages = ", ".join(f"{k} {v*1000:.0f}ms" for k, v in r["stages_s"].items())
+        logger.info("Ready: imports %.0fms, startup %.0fms (%s)", r.get("import_s", 0) * 1000, r["startup_s"] * 1000, stages or "no stages")
+
+# Report
+def parse_importtime(stderr: str) -> List[Dict]:
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line: continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.rstrip("\n"); depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append({"module": name.strip(), "self_us": int(self_us), "cumulative_us": int(cumulative_us), "depth": depth})
+    return rows
+
+STARTUP_SNIPPET = """
+import time, json, asyncio
+t0 = time.perf_counter()
+import {module} as target
+t1 = time.perf_counter()
+async def boot():
+    app = target.app
+    async with app.router.lifespan_context(app):
+        t2 = time.perf_counter()
+    return t2
+t2 = asyncio.run(boot())
+print(json.dumps({{"import_s": t1 - t0, "startup_s": t2 - t1}}))
+"""
+
+def cold_start_report(module: str = "app", top: int = 15) -> Dict:
+    env = dict(os.environ)
+    # -X importtime measures a fresh interpreter, which is what a new worker pays
+    probe = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, env=env)
+    rows = parse_importtime(probe.stderr)
+    loaded = {r["module"] for r in rows}
+    total = next((r["cumulative_us"] for r in rows if r["module"] == module), None)
+    ours = [r for r in rows if r["depth"] <= 1]
+    timed = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET.format(module=module)], capture_output=True, text=True, env=env)
+    try:
+        startup = json.loads(timed.stdout.strip().splitlines()[-1])
+    except Exception:
+        startup = {"error": (timed.stderr or timed.stdout).strip()[-500:]}
+    return {"module": module, "import_total_ms": round(total / 1000, 1) if total else None,
+            "top_imports_ms": [{"module": r["module"], "ms": round(r["cumulative_us"] / 1000, 1)}
+                               for r in sorted(ours, key=lambda r: r["cumulative_us"], reverse=True)[:top]],
+            "heavy_loaded_at_import": {m: (m in loaded) for m in HEAVY_MODULES},
+            "wall": {k: (round(v, 4) if isinstance(v, float) else v) for k, v in startup.items()}}
+
+def main():
+    ap = argparse.ArgumentParser(description="Import-time and cold-start report for the backend.")
+    ap.add_argument("--module", default="app")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args()
+    report = cold_start_report(args.module, args.top)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
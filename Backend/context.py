@@ -0,0 +1,160 @@
+"""Token-budgeted prompt assembly for /chat.
+
+Recent turns of each session are kept in a bounded in-process cache (loaded from the
+DB only on a miss). Each turn's prompt is then packed into CONTEXT_TOKEN_BUDGET:
+system prompt and the new message always, references up to CONTEXT_DOCS_TOKENS,
+then as much recent history as fits, newest first, with the session's rolling
+summary standing in for the turns that were dropped.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Optional, List, Dict
+
+from dotenv import load_dotenv
+
+from models import Session, Message
+from coldstart import lazy_import
+
+tiktoken = lazy_import("tiktoken")
+
+load_dotenv()
+
+# CONFIG
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_DOCS_TOKENS = int(os.getenv("CONTEXT_DOCS_TOKENS", 1200))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 300))
+CONTEXT_WINDOW_MESSAGES = int(os.getenv("CONTEXT_WINDOW_MESSAGES", 20))
+CONTEXT_CACHE_SESSIONS = int(os.getenv("CONTEXT_CACHE_SESSIONS", 2048))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", 300))  # other workers may add turns to the same session
+MESSAGE_OVERHEAD_TOKENS = 4  # role and separators per chat message
+
+logger = logging.getLogger("medisos")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def get_encoding():
+    # loading the BPE ranks takes a while (and may hit the network once), so it
+    # happens off the event loop: warmed up at startup, else on the first prompt
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                if tiktoken is not None:
+                    try:
+                        _encoding = tiktoken.get_encoding("cl100k_base")
+                    except Exception as e:
+                        logger.warning("tiktoken unavailable, counting chars/4: %s", e)
+                _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    if not text: return 0
+    if get_encoding() is not None: return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4  # ~4 characters per token for English
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0: return ""
+    if count_tokens(text) <= max_tokens: return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens]) + "…"
+    return text[:max_tokens * 4] + "…"
+
+class SessionHistoryCache:
+    """Bounded LRU of sessions -> their last `window` messages and rolling summary."""
+
+    def __init__(self, max_sessions: int = CONTEXT_CACHE_SESSIONS, window: int = CONTEXT_WINDOW_MESSAGES, ttl: float = CONTEXT_CACHE_TTL):
+        self.max_sessions = max_sessions
+        self.window = window
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: int) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or time.monotonic() - entry["loaded_at"] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry
+
+    def load(self, db, session_id: int) -> Dict:
+        s = db.query(Session.summary).filter(Session.id == session_id).first()
+        rows = (db.query(Message.sender, Message.text).filter(Message.session_id == session_id)
+                .order_by(Message.created_at.desc(), Message.id.desc()).limit(self.window).all())
+        entry = {"messages": deque(maxlen=self.window), "summary": (s.summary if s else None), "loaded_at": time.monotonic()}
+        for sender, text in reversed(rows):
+            entry["messages"].append(self._message(sender, text))
+        with self._lock:
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _message(sender: str, text: str) -> Dict:
+        text = text or ""
+        return {"role": ("assistant" if sender == "assistant" else "user"), "content": text,
+                "tokens": count_tokens(text) + MESSAGE_OVERHEAD_TOKENS}
+
+    def append(self, session_id: int, sender: str, text: str):
+        # only extend cached sessions; an uncached one is loaded whole on next use
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None: entry["messages"].append(self._message(sender, text))
+
+    def set_summary(self, session_id: int, summary: Optional[str]):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None: entry["summary"] = summary
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"sessions": len(self._entries), "max_sessions": self.max_sessions, "hits": self.hits,
+                "misses": self.misses, "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "tokenizer": ("tiktoken" if _encoding is not None else "chars/4")}
+
+CONTEXT_CACHE = SessionHistoryCache()
+
+def assemble_context(system_prompt: str, user_text: str, history: Optional[Dict], retrieved: List[Dict],
+                     budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    system_msg = {"role":"system","content":system_prompt}
+    user_msg = {"role":"user","content":user_text}
+    remaining = budget - count_tokens(system_prompt) - count_tokens(user_text) - 2 * MESSAGE_OVERHEAD_TOKENS
+
+    # references: an even share per document, within the docs budget
+    refs = None
+    if retrieved and remaining > 0:
+        docs_budget = min(CONTEXT_DOCS_TOKENS, remaining)
+        per_doc = docs_budget // len(retrieved)
+        docs_text = "\n\n---\n\n".join(truncate_tokens(d["text"], per_doc) for d in retrieved)
+        refs = {"role":"system","content":f"References:\n{docs_text}"}
+        remaining -= count_tokens(refs["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    # history: newest first while it fits; the rolling summary covers what's left out
+    kept: List[Dict] = []
+    summary_msg = None
+    if history:
+        past = list(history["messages"])
+        reserve = min(CONTEXT_SUMMARY_TOKENS, max(remaining, 0)) if history.get("summary") else 0
+        for m in reversed(past):
+            if m["tokens"] > remaining - reserve: break
+            kept.append({"role": m["role"], "content": m["content"]}); remaining -= m["tokens"]
+        kept.reverse()
+        summary = truncate_tokens(history.get("summary") or "", reserve - MESSAGE_OVERHEAD_TOKENS)
+        if summary and (len(kept) < len(past) or len(past) == history["messages"].maxlen):
+            summary_msg = {"role":"system","content":"Conversation so far (summary): " + summary}
+
+    messages = [system_msg]
+    if summary_msg: messages.append(summary_msg)
+    if refs: messages.append(refs)
+    return messages + kept + [user_msg]
@@ -0,0 +1,134 @@
+import os
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+
+from metrics import stage
+
+load_dotenv()
+
+# CONFIG
+DATABASE_URL = os.getenv("DATABASE_URL", "#")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BEHIND_BATCH = int(os.getenv("DB_WRITE_BEHIND_BATCH", 200))
+DB_WRITE_BEHIND_INTERVAL_MS = float(os.getenv("DB_WRITE_BEHIND_INTERVAL_MS", 50))
+DB_WRITE_BEHIND_MAX_QUEUE = int(os.getenv("DB_WRITE_BEHIND_MAX_QUEUE", 10000))
+
+logger = logging.getLogger("medisos")
+
+def make_engine(url: str = DATABASE_URL):
+    if "sqlite" in url:
+        return create_engine(url, connect_args={"check_same_thread": False})
+    # size the pool for threadpool concurrency; pre_ping drops connections the server closed
+    return create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                         pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+Base = declarative_base()
+engine = make_engine()
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+def get_db():
+    db = SessionLocal()
+    try: yield db
+    finally: db.close()
+
+@contextmanager
+def unit_of_work(db):
+    """Everything added inside the block is committed together, or not at all."""
+    try:
+        yield db
+        with stage("db_commit"): db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+class WriteBehindQueue:
+    """Batches inserts from many requests into one transaction on a background thread.
+
+    Rows wait at most `interval_ms` (or until `max_batch` rows) before being written.
+    When the queue is full, `submit` returns False and the caller writes inline.
+    Rows still queued are lost if the process dies, so only use it for rows that can
+    afford that; call `flush()` on shutdown.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_batch: int = DB_WRITE_BEHIND_BATCH,
+                 interval_ms: float = DB_WRITE_BEHIND_INTERVAL_MS, max_queue: int = DB_WRITE_BEHIND_MAX_QUEUE):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.interval = interval_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+                self._worker.start()
+
+    def submit(self, rows: List) -> bool:
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(rows)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def _write(self, groups: List[List]):
+        db = self.session_factory()
+        try:
+            with unit_of_work(db):
+                for rows in groups: db.add_all(rows)
+            self.written += sum(len(r) for r in groups); self.batches += 1
+        except Exception as e:
+            # one bad turn must not sink the batch: retry each turn on its own
+            logger.warning("Write-behind batch failed (%s); retrying per turn", e)
+            for rows in groups:
+                try:
+                    with unit_of_work(db): db.add_all(rows)
+                    self.written += len(rows)
+                except Exception as e2:
+                    self.failed += len(rows)
+                    logger.error("Write-behind dropped %d rows: %s", len(rows), e2)
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            groups = [self._queue.get()]
+            size = len(groups[0])
+            try:
+                while size < self.max_batch:
+                    try:
+                        rows = self._queue.get(timeout=self.interval)
+                    except queue.Empty:
+                        break
+                    groups.append(rows); size += len(rows)
+                self._write(groups)
+            finally:
+                for _ in groups: self._queue.task_done()
+
+    def flush(self):
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.join()
+
+    def stats(self) -> Dict:
+        return {"enabled": DB_WRITE_BEHIND, "queued": self._queue.qsize(), "batches": self.batches,
+                "written": self.written, "failed": self.failed, "rejected": self.rejected}
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,285 @@
+import os
+import time
+import queue
+import sqlite3
+import hashlib
+import asyncio
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, List, Dict
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from providers import get_openrouter_embeddings
+
+load_dotenv()
+
+# CONFIG
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openrouter")  # openrouter | local
+EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_BATCH = int(os.getenv("LOCAL_EMBED_BATCH", 64))
+LOCAL_EMBED_WAIT_MS = float(os.getenv("LOCAL_EMBED_WAIT_MS", 5))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 4096))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embeddings_cache.sqlite3")  # empty -> memory only
+EMBED_CACHE_DISK_MAX = int(os.getenv("EMBED_CACHE_DISK_MAX", 200000))
+EMBED_CACHE_EVICT_EVERY = int(os.getenv("EMBED_CACHE_EVICT_EVERY", 256))  # disk writes between size checks
+
+logger = logging.getLogger("medisos")
+
+def normalize_text(text: str) -> str:
+    # openers like "I feel anxious" / "i feel  anxious " should share one entry
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Two-level cache of embedding vectors keyed by (model, normalized-text hash).
+
+    Level 1 is a bounded in-process LRU. Level 2 is an optional SQLite file shared by
+    every uvicorn worker on the host (WAL mode, so readers don't block the writer);
+    every `evict_every` writes it is trimmed back to `disk_max` rows, oldest writes first.
+    """
+
+    def __init__(self, max_items: int = EMBED_CACHE_SIZE, db_path: Optional[str] = EMBED_CACHE_PATH,
+                 disk_max: int = EMBED_CACHE_DISK_MAX, evict_every: int = EMBED_CACHE_EVICT_EVERY):
+        self.max_items = max_items
+        self.db_path = db_path or None
+        self.disk_max = disk_max
+        self.evict_every = max(1, evict_every)
+        self._puts = 0
+        self._lru: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # disk tier
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (model TEXT NOT NULL, key TEXT NOT NULL, "
+                               "vector BLOB NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (model, key))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_created_at ON embeddings (created_at)")
+        return self._conn
+
+    def _disk_get(self, model: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not self.db_path or not keys: return {}
+        found = {}
+        with self._lock:
+            db = self._db()
+            # stay under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                marks = ",".join("?" * len(chunk))
+                rows = db.execute(f"SELECT key, vector FROM embeddings WHERE model=? AND key IN ({marks})", [model, *chunk])
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def _disk_put(self, model: str, items: Dict[str, np.ndarray]):
+        if not self.db_path or not items: return
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO embeddings (model, key, vector, created_at) VALUES (?,?,?,?)",
+                           [(model, k, v.astype("float32").tobytes(), now) for k, v in items.items()])
+            # COUNT(*) scans the whole table: check on the first write, then every evict_every
+            if self._puts % self.evict_every == 0:
+                (count,) = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+                if count > self.disk_max:
+                    db.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY created_at LIMIT ?)",
+                               (count - self.disk_max,))
+                    self.evictions += count - self.disk_max
+            self._puts += 1
+            db.execute("COMMIT")
+
+    # memory tier
+    def _mem_get(self, model: str, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._lru.get((model, key))
+            if vec is not None: self._lru.move_to_end((model, key))
+            return vec
+
+    def _mem_put(self, model: str, key: str, vec: np.ndarray):
+        with self._lock:
+            self._lru[(model, key)] = vec
+            self._lru.move_to_end((model, key))
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False); self.evictions += 1
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(model, t) for t in texts]
+        out = [self._mem_get(model, k) for k in keys]
+        missing = [k for k, v in zip(keys, out) if v is None]
+        self.memory_hits += len(keys) - len(missing)
+        if missing:
+            found = self._disk_get(model, missing)
+            for i, k in enumerate(keys):
+                if out[i] is None and k in found:
+                    out[i] = found[k]; self._mem_put(model, k, found[k])
+            self.disk_hits += sum(1 for k in missing if k in found)
+            self.misses += sum(1 for k in missing if k not in found)
+        return out
+
+    def put_many(self, model: str, texts: List[str], vectors: List[np.ndarray]):
+        items = {cache_key(model, t): np.asarray(v, dtype="float32") for t, v in zip(texts, vectors)}
+        for k, v in items.items(): self._mem_put(model, k, v)
+        try:
+            self._disk_put(model, items)
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache write failed: %s", e)
+
+    def invalidate(self, model: Optional[str] = None) -> int:
+        """Drop cached vectors for `model` (or everything); returns disk rows removed."""
+        with self._lock:
+            for k in [k for k in self._lru if model is None or k[0] == model]:
+                del self._lru[k]
+            if not self.db_path: return 0
+            db = self._db()
+            if model is None: cur = db.execute("DELETE FROM embeddings")
+            else: cur = db.execute("DELETE FROM embeddings WHERE model=?", (model,))
+            return cur.rowcount
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_items": len(self._lru), "memory_max": self.max_items, "disk_path": self.db_path,
+                "memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0}
+
+EMBED_CACHE = EmbeddingCache()
+
+# Backends
+class OpenRouterEmbeddings:
+    """Remote embeddings through the OpenRouter /embeddings endpoint."""
+
+    name = "openrouter"
+
+    def __init__(self, model: str = EMBED_MODEL):
+        self.model = model
+        self.cache_model = model
+
+    async def embed(self, texts: List[str]) -> List[np.ndarray]:
+        data = await get_openrouter_embeddings(texts, model=self.model)
+        data = sorted(data, key=lambda item: item.get("index", 0))
+        return [np.array(item["embedding"], dtype="float32") for item in data]
+
+def _resolve(fut: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    if fut.done(): return  # caller went away (request cancelled)
+    if error is not None: fut.set_exception(error)
+    else: fut.set_result(result)
+
+class LocalEmbeddings:
+    """sentence-transformers on CPU, micro-batched across concurrent callers.
+
+    Inference runs on one dedicated daemon thread so the event loop never blocks.
+    Requests queue up; the worker takes the first one, keeps collecting for at most
+    `max_wait_ms` (or until `max_batch` texts) and encodes them in a single pass.
+    """
+
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_EMBED_MODEL, max_batch: int = LOCAL_EMBED_BATCH, max_wait_ms: float = LOCAL_EMBED_WAIT_MS):
+        self.model = model
+        self.cache_model = f"local:{model}"
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._encoder = None
+        self.batches = 0
+        self.encoded = 0
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="local-embeddings", daemon=True)
+                self._worker.start()
+
+    def _load(self):
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.model, device="cpu")
+        return self._encoder
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self._load().encode(texts, batch_size=self.max_batch, convert_to_numpy=True,
+                                              show_progress_bar=False), dtype="float32")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item); size += len(item[0])
+            texts = [t for item in batch for t in item[0]]
+            try:
+                vectors = self.encode(texts)
+            except Exception as e:
+                logger.error("Local embedding failed: %s", e)
+                for _, fut, loop in batch: loop.call_soon_threadsafe(_resolve, fut, None, e)
+                continue
+            self.batches += 1; self.encoded += len(texts)
+            offset = 0
+            for item_texts, fut, loop in batch:
+                chunk = list(vectors[offset:offset+len(item_texts)]); offset += len(item_texts)
+                loop.call_soon_threadsafe(_resolve, fut, chunk)
+
+    async def embed(self, texts: List[str]) -> List[np.ndarray]:
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((list(texts), fut, loop))
+        return await fut
+
+_BACKENDS: Dict[str, object] = {}
+
+def get_embedding_backend(name: Optional[str] = None):
+    name = name or EMBED_BACKEND
+    if name not in _BACKENDS:
+        if name == "openrouter": _BACKENDS[name] = OpenRouterEmbeddings()
+        elif name == "local": _BACKENDS[name] = LocalEmbeddings()
+        else: raise ValueError(f"Unknown embedding backend: {name}")
+    return _BACKENDS[name]
+
+async def embed_texts(texts: List[str], backend: Optional[str] = None) -> List[np.ndarray]:
+    """Embed `texts` in order with the selected backend, computing only cache misses."""
+    be = get_embedding_backend(backend)
+    model = be.cache_model
+    # memory hits are answered inline; only a cold lookup pays for the thread hop to SQLite
+    cached = [EMBED_CACHE._mem_get(model, cache_key(model, t)) for t in texts]
+    if any(v is None for v in cached):
+        cached = await asyncio.to_thread(EMBED_CACHE.get_many, model, texts)
+    else:
+        EMBED_CACHE.memory_hits += len(texts)
+    todo = [i for i, v in enumerate(cached) if v is None]
+    if todo:
+        # duplicates inside one request are embedded once
+        unique = list(dict.fromkeys(texts[i] for i in todo))
+        vectors = await be.embed(unique)
+        if len(vectors) != len(unique):
+            # never cache or hand out vectors that may belong to other texts
+            raise HTTPException(status_code=502, detail=f"Embedding provider returned {len(vectors)} vectors for {len(unique)} inputs")
+        await asyncio.to_thread(EMBED_CACHE.put_many, model, unique, vectors)
+        fresh = dict(zip(unique, vectors))
+        for i in todo: cached[i] = fresh[texts[i]]
+    return cached
@@ -0,0 +1,106 @@
+import io
+import csv
+import json
+import base64
+from datetime import datetime
+from typing import Optional, List, Dict, Iterator
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+from db import SessionLocal
+from models import Message, Session
+
+MESSAGE_FIELDS = ["id", "session_id", "sender", "text", "risk_score", "emotion", "sentiment", "created_at"]
+HEAVY_FIELDS = {"text"}
+EXPORT_YIELD_PER = 1000
+
+def parse_fields(fields: Optional[str], default: List[str]) -> List[str]:
+    if not fields: return default
+    chosen = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in chosen if f not in MESSAGE_FIELDS]
+    if unknown: raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return chosen
+
+def message_row(m, fields: List[str]) -> Dict:
+    row = {}
+    for f in fields:
+        v = getattr(m, f)
+        row[f] = v.isoformat() if isinstance(v, datetime) else v
+    return row
+
+# Keyset pagination on (session_id, created_at, id): every page is one index range
+# scan no matter how deep, unlike OFFSET which re-reads all earlier rows.
+def encode_cursor(m) -> str:
+    raw = json.dumps([m.created_at.isoformat(), m.id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, mid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(mid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(cursor: Optional[str]):
+    if not cursor: return None
+    created_at, mid = decode_cursor(cursor)
+    return or_(Message.created_at > created_at, and_(Message.created_at == created_at, Message.id > mid))
+
+def message_columns(fields: List[str]):
+    # id and created_at are always loaded: the cursor is built from them
+    return [getattr(Message, f) for f in dict.fromkeys(["id", "created_at", *fields])]
+
+def message_page(db, session_id: int, limit: int, cursor: Optional[str], fields: List[str]) -> Dict:
+    q = db.query(*message_columns(fields)).filter(Message.session_id == session_id)
+    cond = after_cursor(cursor)
+    if cond is not None: q = q.filter(cond)
+    rows = q.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"session_id": session_id, "messages": [message_row(m, fields) for m in rows],
+            "next_cursor": (encode_cursor(rows[-1]) if more else None)}
+
+def iter_conversation(db, session_id: int) -> Iterator:
+    """(sender, text) of one session in order, fetched in chunks rather than all at once."""
+    q = (db.query(Message.sender, Message.text).filter(Message.session_id == session_id)
+         .order_by(Message.created_at.asc(), Message.id.asc())
+         .execution_options(stream_results=True).yield_per(EXPORT_YIELD_PER))
+    yield from q
+
+# Export: server-side cursor (stream_results) + yield_per keeps memory flat for
+# months of conversations; rows are serialized as they arrive.
+def iter_export_rows(session_ids: Optional[List[int]], user_id: Optional[int], since: Optional[datetime],
+                     until: Optional[datetime], fields: List[str]) -> Iterator[Dict]:
+    db = SessionLocal()
+    try:
+        q = db.query(*message_columns(fields))
+        if session_ids: q = q.filter(Message.session_id.in_(session_ids))
+        if user_id is not None:
+            q = q.join(Session, Session.id == Message.session_id).filter(Session.user_id == user_id)
+        if since: q = q.filter(Message.created_at >= since)
+        if until: q = q.filter(Message.created_at < until)
+        q = (q.order_by(Message.session_id.asc(), Message.created_at.asc(), Message.id.asc())
+             .execution_options(stream_results=True).yield_per(EXPORT_YIELD_PER))
+        for m in q:
+            yield message_row(m, fields)
+    finally:
+        db.close()
+
+def ndjson_lines(rows: Iterator[Dict], batch: int = 200) -> Iterator[str]:
+    buf = []
+    for row in rows:
+        buf.append(json.dumps(row))
+        if len(buf) >= batch:
+            yield "\n".join(buf) + "\n"; buf = []
+    if buf: yield "\n".join(buf) + "\n"
+
+def csv_lines(rows: Iterator[Dict], fields: List[str], batch: int = 200) -> Iterator[str]:
+    out = io.StringIO(); writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    n = 0
+    for row in rows:
+        writer.writerow(row); n += 1
+        if n % batch == 0:
+            yield out.getvalue(); out.seek(0); out.truncate()
+    yield out.getvalue()
@@ -0,0 +1,248 @@
+"""Outbox email delivery.
+
+Requests never talk to the mail server: /end_session adds an OutboxEmail row in the
+same transaction as the Report and nudges the dispatcher. EmailDispatcher is a daemon
+thread that claims due rows in batches and sends them over one authenticated SMTP
+connection, kept open between batches and re-opened when the server drops it.
+Failed sends are retried with exponential backoff and jitter up to
+EMAIL_MAX_ATTEMPTS; permanent (5xx) rejections fail at once.
+"""
+import os
+import time
+import random
+import smtplib
+import logging
+import threading
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from typing import Optional, List, Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import func, or_, and_
+
+from db import SessionLocal, unit_of_work
+from models import OutboxEmail, Report
+from history import iter_conversation
+
+load_dotenv()
+
+# CONFIG
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASS = os.getenv("SMTP_PASS")
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER or "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", 60))  # most servers drop idle sessions after a few minutes
+EMAIL_BATCH = int(os.getenv("EMAIL_BATCH", 20))
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", 5))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 8))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", 30))
+EMAIL_RETRY_MAX = float(os.getenv("EMAIL_RETRY_MAX", 3600))
+EMAIL_CLAIM_LEASE = float(os.getenv("EMAIL_CLAIM_LEASE", 300))  # rows stuck in "sending" this long are picked up again
+
+logger = logging.getLogger("medisos")
+
+def smtp_configured() -> bool:
+    return bool(SMTP_HOST and SMTP_FROM)
+
+def queue_email(db, to_email: str, subject: str, body: Optional[str] = None, report: Optional[Report] = None) -> OutboxEmail:
+    # the caller commits, together with whatever the email is about
+    row = OutboxEmail(to_email=to_email, subject=subject, body=body, report=report)
+    db.add(row)
+    return row
+
+def render_report_body(db, report: Report) -> str:
+    user = report.user
+    convo = "\n\n".join(f"{sender}: {text}" for sender, text in iter_conversation(db, report.session_id))
+    return (f"Patient: {user.first_name} {user.last_name}\nEmail: {user.email}\n\nSummary:\n{report.summary}\n\nUrgency: {report.urgency}\nRisk Score: {report.risk_score}\n\nFull conversation:\n{convo}")
+
+def build_message(sender: str, row: OutboxEmail) -> str:
+    msg = MIMEMultipart(); msg["From"]=sender; msg["To"]=row.to_email; msg["Subject"]=row.subject
+    msg.attach(MIMEText(row.body,"plain"))
+    return msg.as_string()
+
+def is_permanent(e: Exception) -> bool:
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return isinstance(e, smtplib.SMTPDataError) and e.smtp_code >= 500
+
+def is_connection_error(e: Exception) -> bool:
+    if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError)): return True
+    # SMTPException subclasses OSError; only socket-level errors count here
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+class SMTPConnection:
+    """One SMTP session (STARTTLS + login done once) reused for every send."""
+
+    def __init__(self, host: Optional[str] = SMTP_HOST, port: int = SMTP_PORT, user: Optional[str] = SMTP_USER,
+                 password: Optional[str] = SMTP_PASS, starttls: bool = SMTP_STARTTLS, timeout: float = SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls: smtp.starttls()
+            if self.user and self.password: smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close(); raise
+        self._smtp = smtp; self.connects += 1
+
+    def send(self, sender: str, to_email: str, message: str):
+        # a kept-alive session may have been closed by the server since the last
+        # send; reconnect once before giving up
+        for attempt in (0, 1):
+            if self._smtp is None: self._open()
+            try:
+                self._smtp.sendmail(sender, [to_email], message)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt: raise
+
+    def close_if_idle(self, idle_seconds: float):
+        if self._smtp is not None and time.monotonic() - self._last_used > idle_seconds:
+            self.close()
+
+    def close(self):
+        if self._smtp is None: return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+class EmailDispatcher:
+    """Background sender for the email outbox.
+
+    Each pass claims up to `batch` due rows (status -> "sending"), delivers them one by
+    one over the shared connection and records the outcome per row. Claims use
+    SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, so dispatchers
+    in several uvicorn workers can share the table; a claim older than
+    EMAIL_CLAIM_LEASE (the worker died mid-send) is taken over.
+    """
+
+    def __init__(self, session_factory=SessionLocal, connection: Optional[SMTPConnection] = None, batch: int = EMAIL_BATCH,
+                 poll_seconds: float = EMAIL_POLL_SECONDS, max_attempts: int = EMAIL_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.conn = connection or SMTPConnection()
+        self.batch = batch
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self.batches = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> bool:
+        if not smtp_configured():
+            logger.warning("SMTP not configured; outbox emails stay queued")
+            return False
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="email-dispatcher", daemon=True)
+            self._worker.start()
+        return True
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set(); self._wake.set()
+        if self._worker is not None: self._worker.join(timeout)
+
+    def _claim(self, db) -> List[OutboxEmail]:
+        now = datetime.utcnow()
+        due = or_(and_(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now),
+                  and_(OutboxEmail.status == "sending", OutboxEmail.claimed_at < now - timedelta(seconds=EMAIL_CLAIM_LEASE)))
+        with unit_of_work(db):
+            rows = (db.query(OutboxEmail).filter(due).order_by(OutboxEmail.id)
+                    .limit(self.batch).with_for_update(skip_locked=True).all())
+            for row in rows: row.status = "sending"; row.claimed_at = now
+        return rows
+
+    def _retry_later(self, row: OutboxEmail, error: Exception):
+        row.last_error = str(error)[:1000]
+        if is_permanent(error) or row.attempts >= self.max_attempts:
+            row.status = "failed"; self.failed += 1
+            logger.error("Email %d to %s failed after %d attempts: %s", row.id, row.to_email, row.attempts, error)
+            return
+        # exponential backoff with jitter so a recovering server isn't hit by every row at once
+        delay = min(EMAIL_RETRY_MAX, EMAIL_RETRY_BASE * 2 ** (row.attempts - 1)) * random.uniform(0.5, 1.0)
+        row.status = "pending"; row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay); self.retried += 1
+        logger.warning("Email %d to %s failed (attempt %d), retrying in %.0fs: %s", row.id, row.to_email, row.attempts, delay, error)
+
+    def _deliver(self, db, row: OutboxEmail) -> bool:
+        """Send one row and record the outcome; False when the server itself is unreachable."""
+        with unit_of_work(db):
+            row.attempts += 1
+            try:
+                if row.body is None: row.body = render_report_body(db, row.report)
+                self.conn.send(SMTP_FROM, row.to_email, build_message(SMTP_FROM, row))
+            except Exception as e:
+                self.last_error = str(e)
+                self._retry_later(row, e)
+                if is_connection_error(e):
+                    self.conn.close()
+                    return False
+            else:
+                row.status = "sent"; row.sent_at = datetime.utcnow(); row.last_error = None; self.sent += 1
+        return True
+
+    def run_once(self) -> int:
+        """One dispatch pass; returns how many rows were claimed."""
+        db = self.session_factory()
+        try:
+            rows = self._claim(db)
+            for i, row in enumerate(rows):
+                if not self._deliver(db, row):
+                    # no point trying the rest of the batch against a dead server
+                    with unit_of_work(db):
+                        for rest in rows[i+1:]: rest.status = "pending"; rest.next_attempt_at = row.next_attempt_at
+                    break
+            if rows: self.batches += 1
+            return len(rows)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error("Email dispatch pass failed: %s", e); claimed = 0
+            if claimed >= self.batch: continue  # probably more due right now
+            self.conn.close_if_idle(SMTP_IDLE_SECONDS)
+            self._wake.wait(self.poll_seconds); self._wake.clear()
+        self.conn.close()
+
+    def stats(self) -> Dict:
+        db = self.session_factory()
+        try:
+            counts = dict(db.query(OutboxEmail.status, func.count(OutboxEmail.id)).group_by(OutboxEmail.status).all())
+            oldest = (db.query(func.min(OutboxEmail.created_at))
+                      .filter(OutboxEmail.status.in_(("pending", "sending"))).scalar())
+        finally:
+            db.close()
+        return {"configured": smtp_configured(), "running": bool(self._worker and self._worker.is_alive()),
+                "queue_depth": counts.get("pending", 0) + counts.get("sending", 0), "by_status": counts,
+                "oldest_queued_s": ((datetime.utcnow() - oldest).total_seconds() if oldest else 0.0),
+                "batches": self.batches, "sent": self.sent, "retried": self.retried, "failed": self.failed,
+                "connects": self.conn.connects, "last_error": self.last_error}
+
+email_dispatcher = EmailDispatcher()
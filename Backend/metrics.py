@@ -0,0 +1,218 @@
+"""In-process metrics in the Prometheus text format, plus optional request trace ids.
+
+Counters, gauges and histograms live in one registry and are rendered by /metrics.
+Subsystems that already keep their own stats (caches, risk cascade, outbox) are
+registered as collectors and read at scrape time instead of being double-counted.
+No client library needed; each worker reports its own numbers (scrape every
+worker, or run one worker per container).
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# CONFIG
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+LOG_TRACE_IDS = os.getenv("LOG_TRACE_IDS", "0") == "1"
+TRACE_HEADER = "x-request-id"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("medisos")
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names: return ""
+    pairs = ",".join('{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _add(self, amount: float, labels: Tuple):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in self._values.items()]
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._add(amount, labels)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._add(amount, labels)
+
+    def dec(self, *labels, amount: float = 1.0):
+        self._add(-amount, labels)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None: s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: s[i] += 1; break
+            s[-2] += value; s[-1] += 1
+
+    def samples(self) -> List[str]:
+        out = []
+        with self._lock:
+            for labels, s in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, s):
+                    cumulative += n
+                    out.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (bound,))} {cumulative}")
+                out.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + ('+Inf',))} {s[-1]}")
+                out.append(f"{self.name}_sum{_labels(self.label_names, labels)} {s[-2]}")
+                out.append(f"{self.name}_count{_labels(self.label_names, labels)} {s[-1]}")
+        return out
+
+REGISTRY: List[Metric] = []
+COLLECTORS: List[Tuple[str, Callable[[], Dict]]] = []
+
+def register_collector(prefix: str, stats: Callable[[], Dict]):
+    """Expose the numeric fields of `stats()` as `<prefix>_<field>` gauges at scrape time."""
+    COLLECTORS.append((prefix, stats))
+
+def _flatten(prefix: str, data: Dict) -> List[str]:
+    out = []
+    for k, v in data.items():
+        name = f"{prefix}_{k}"
+        if isinstance(v, dict): out += _flatten(name, v)
+        elif isinstance(v, (bool, int, float)): out.append(f"{name} {float(v)}")
+    return out
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY: lines += metric.render()
+    for prefix, stats in COLLECTORS:
+        try:
+            lines += _flatten(prefix, stats())
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", prefix, e)
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram("medisos_stage_seconds", "Time spent in one stage of a request.", ("stage",))
+HTTP_REQUESTS = Counter("medisos_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("medisos_http_request_seconds", "HTTP request duration including streamed bodies.", ("route",))
+HTTP_INFLIGHT = Gauge("medisos_http_inflight", "HTTP requests currently being served.")
+PROVIDER_REQUESTS = Counter("medisos_provider_requests_total", "LLM provider calls by outcome.", ("endpoint", "model", "outcome"))
+PROVIDER_SECONDS = Histogram("medisos_provider_seconds", "LLM provider call duration.", ("endpoint",))
+PROVIDER_TOKENS = Counter("medisos_provider_tokens_total", "Tokens reported by the provider.", ("endpoint", "kind"))
+PROVIDER_INFLIGHT = Gauge("medisos_provider_inflight", "LLM provider calls in flight.", ("endpoint",))
+
+@contextmanager
+def stage(name: str):
+    # usable around awaits too: it measures wall time between entry and exit
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, name)
+
+@contextmanager
+def provider_call(endpoint: str, model: str):
+    PROVIDER_INFLIGHT.inc(endpoint)
+    start = time.perf_counter(); outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except BaseException as e:
+        if not isinstance(e, Exception): outcome = "cancelled"  # client went away mid-call
+        raise
+    finally:
+        PROVIDER_INFLIGHT.dec(endpoint)
+        PROVIDER_SECONDS.observe(time.perf_counter() - start, endpoint)
+        PROVIDER_REQUESTS.inc(endpoint, model, outcome)
+
+def record_usage(endpoint: str, usage: Optional[Dict]):
+    for key in ("prompt_tokens", "completion_tokens"):
+        if usage and usage.get(key): PROVIDER_TOKENS.inc(endpoint, key.split("_")[0], amount=usage[key])
+
+# Trace ids
+TRACE_ID: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+class TraceIdFilter(logging.Filter):
+    """Adds `trace_id` to every record so formats can use %(trace_id)s."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = TRACE_ID.get()
+        return True
+
+def install_trace_logging():
+    # on the handlers, so records from every logger (uvicorn, httpx, ...) carry it
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:[%(trace_id)s] %(message)s"))
+
+class MetricsMiddleware:
+    """ASGI middleware: request counts, latency and in-flight gauge per route template,
+    and (with LOG_TRACE_IDS) a trace id taken from or returned in X-Request-ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = None
+        if LOG_TRACE_IDS:
+            incoming = dict(scope["headers"]).get(TRACE_HEADER.encode())
+            trace_id = incoming.decode("latin-1")[:64] if incoming else uuid.uuid4().hex[:16]
+            token = TRACE_ID.set(trace_id)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if token is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER.encode(), trace_id.encode("latin-1"))]
+            await send(message)
+
+        HTTP_INFLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_INFLIGHT.dec()
+            # the route template, not the raw path, keeps label cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, route)
+            HTTP_REQUESTS.inc(scope["method"], route, status[0])
+            if token is not None: TRACE_ID.reset(token)
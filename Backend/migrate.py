@@ -0,0 +1,69 @@
+"""Schema migration, run once per deploy instead of on every worker's import.
+
+    cd Backend
+    python migrate.py            # create missing tables, columns and indexes
+    python migrate.py --check    # list what is missing; exit 1 if anything is
+
+Additive only: new tables, new nullable columns and new indexes; an index whose
+columns changed is dropped and rebuilt. Renames, type changes and drops are out
+of scope and need a hand-written migration.
+"""
+import json
+import argparse
+from typing import List, Dict
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from db import Base, engine
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+def pending_changes(bind=engine) -> List[Dict]:
+    insp = inspect(bind)
+    existing = set(insp.get_table_names())
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            changes.append({"op": "create_table", "table": table.name})
+            continue
+        columns = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in columns:
+                changes.append({"op": "add_column", "table": table.name, "column": col.name})
+        indexes = {i["name"]: (list(i["column_names"]), bool(i["unique"])) for i in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                changes.append({"op": "create_index", "table": table.name, "index": index.name})
+            elif indexes[index.name] != ([c.name for c in index.columns], bool(index.unique)):
+                changes.append({"op": "recreate_index", "table": table.name, "index": index.name,
+                                "from": indexes[index.name][0], "to": [c.name for c in index.columns]})
+    return changes
+
+def migrate(bind=engine) -> List[Dict]:
+    changes = pending_changes(bind)
+    tables = Base.metadata.tables
+    with bind.begin() as conn:
+        new_tables = [tables[c["table"]] for c in changes if c["op"] == "create_table"]
+        if new_tables: Base.metadata.create_all(conn, tables=new_tables)
+        for c in changes:
+            if c["op"] == "add_column":
+                col = tables[c["table"]].columns[c["column"]]
+                ddl = CreateColumn(col).compile(dialect=conn.dialect)
+                # added columns must accept the rows that are already there
+                conn.execute(text(f"ALTER TABLE {c['table']} ADD COLUMN {str(ddl).replace(' NOT NULL', '')}"))
+            elif c["op"] in ("create_index", "recreate_index"):
+                index = next(i for i in tables[c["table"]].indexes if i.name == c["index"])
+                if c["op"] == "recreate_index": index.drop(conn)
+                index.create(conn)
+    return changes
+
+def main():
+    ap = argparse.ArgumentParser(description="Create missing tables, columns and indexes.")
+    ap.add_argument("--check", action="store_true", help="only report pending changes")
+    args = ap.parse_args()
+    changes = pending_changes() if args.check else migrate()
+    print(json.dumps({"applied": not args.check, "changes": changes}, indent=2))
+    if args.check and changes: raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
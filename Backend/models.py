@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float, Index
+from sqlalchemy.orm import relationship
+
+from db import Base
+
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    first_name = Column(String(100), nullable=False)
+    last_name = Column(String(100), nullable=False)
+    email = Column(String(150), unique=True, nullable=False)
+    age_group = Column(String(50), nullable=True)
+    password_hash = Column(String(255), nullable=False)
+    psychologist_id = Column(Integer, ForeignKey("psychologists.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Psychologist(Base):
+    __tablename__ = "psychologists"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(200))
+    email = Column(String(255))
+    phone = Column(String(50), nullable=True)
+    notes = Column(Text, nullable=True)
+
+class Session(Base):
+    __tablename__ = "sessions"
+    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    ended_at = Column(DateTime, nullable=True)
+    status = Column(String(20), default="active")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # rolling summary state, see summaries.py
+    summary = Column(Text, nullable=True)
+    summary_risk_score = Column(Integer, nullable=True)
+    summary_urgency = Column(String(20), nullable=True)
+    summary_upto_id = Column(Integer, default=0)  # last Message.id folded into the summary
+    risk_max = Column(Integer, nullable=True)
+    risk_total = Column(Integer, default=0)
+    risk_count = Column(Integer, default=0)
+
+    user = relationship("User")
+
+class Message(Base):
+    __tablename__ = "messages"
+    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
+    session_id = Column(Integer, ForeignKey("sessions.id"))
+    sender = Column(String(20))  # 'user' or 'assistant'
+    text = Column(Text)
+    sentiment = Column(Float, nullable=True)
+    emotion = Column(String(50), nullable=True)
+    risk_score = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    session = relationship("Session")
+
+    # history reads are always "messages of one session in time order"; id breaks
+    # ties for keyset pagination
+    __table_args__ = (Index("ix_messages_session_created", "session_id", "created_at", "id"),)
+
+class Report(Base):
+    __tablename__ = "reports"
+    id = Column(Integer, primary_key=True, autoincrement=True)  # auto-increment int
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    psychologist_id = Column(Integer, nullable=True)
+    summary = Column(Text)
+    risk_score = Column(Integer)
+    urgency = Column(String(20), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = relationship("User")
+    session = relationship("Session")
+
+    __table_args__ = (Index("ix_reports_session_created", "session_id", "created_at"),)
+
+class OutboxEmail(Base):
+    """Emails waiting for the background dispatcher (mailer.py).
+
+    Rows are written in the same transaction as the Report they announce, so a report
+    is never saved without its email or the other way round.
+    """
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    report_id = Column(Integer, ForeignKey("reports.id"), nullable=True)
+    to_email = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=True)  # None -> rendered from the report when sent
+    status = Column(String(20), default="pending")  # pending | sending | sent | failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    report = relationship("Report")
+
+    # the dispatcher polls "due rows of a status, oldest first"
+    __table_args__ = (Index("ix_email_outbox_status_next", "status", "next_attempt_at"),)
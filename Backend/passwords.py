@@ -0,0 +1,90 @@
+"""bcrypt off the event loop and off the request threadpool.
+
+Hashing and verifying run in a small process pool (PASSWORD_HASH_WORKERS), so a
+login storm keeps those processes busy instead of the threads chat requests need
+for their DB work. At most PASSWORD_MAX_PENDING operations are admitted at once;
+past that /register and /login answer 503 with Retry-After rather than queueing
+without bound.
+"""
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+
+# CONFIG
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))  # 0 -> run in threads instead
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", 16))
+
+# worker side: each pool process builds its own CryptContext once
+_context = None
+
+def _crypt_context():
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+        _context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _context
+
+def _hash(password: str) -> str:
+    return _crypt_context().hash(password)
+
+def _verify(password: str, hashed: str) -> bool:
+    return _crypt_context().verify(password, hashed)
+
+# request side
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0  # only touched on the event loop thread
+COUNTERS: Dict[str, int] = {"hashed": 0, "verified": 0, "rejected": 0, "pool_restarts": 0}
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if _pool is None and PASSWORD_HASH_WORKERS > 0:
+        # spawn, not fork: the parent already runs background threads (children re-import
+        # the parent's __main__, so entry scripts need the usual __main__ guard)
+        _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= PASSWORD_MAX_PENDING:
+        COUNTERS["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Too many sign-in attempts, try again shortly", headers={"Retry-After": "1"})
+    _pending += 1
+    try:
+        for attempt in range(2):
+            pool = get_pool()
+            if pool is None: return await asyncio.to_thread(fn, *args)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+            except BrokenProcessPool:
+                # a worker died and took the executor with it: replace it, retry once
+                if _pool is pool: shutdown_pool()
+                COUNTERS["pool_restarts"] += 1
+                if attempt: raise
+    finally:
+        _pending -= 1
+
+async def hash_password(password: str) -> str:
+    hashed = await _run(_hash, password)
+    COUNTERS["hashed"] += 1
+    return hashed
+
+async def verify_password(password: str, hashed: str) -> bool:
+    ok = await _run(_verify, password, hashed)
+    COUNTERS["verified"] += 1
+    return ok
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None: _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+def password_stats() -> Dict:
+    return {"workers": PASSWORD_HASH_WORKERS, "pending": _pending, "max_pending": PASSWORD_MAX_PENDING, **COUNTERS}
@@ -0,0 +1,77 @@
+"""Opt-in sampling profiler (PROFILER_ENABLED=1).
+
+A daemon thread snapshots every other thread's Python stack each PROFILER_INTERVAL_MS
+and counts identical stacks. GET /debug/profile returns them in the collapsed
+"frame;frame;frame count" format that flamegraph.pl and speedscope read. Sampling
+costs one sys._current_frames() call per tick; nothing is traced.
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# CONFIG
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", 10))
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", 64))
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, max_depth: int = PROFILER_MAX_DEPTH):
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self.samples = 0
+        self.started_at: Optional[float] = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me: continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                frames.append(self._frame_name(frame)); frame = frame.f_back
+            stacks.append(";".join([names.get(ident, str(ident))] + frames[::-1]))
+        with self._lock:
+            self._stacks.update(stacks); self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        if self._worker is not None and self._worker.is_alive(): return
+        self._stop.clear(); self.started_at = time.time()
+        self._worker = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None: self._worker.join(1)
+
+    def collapsed(self, reset: bool = False) -> str:
+        with self._lock:
+            lines = [f"{stack} {n}" for stack, n in self._stacks.most_common()]
+            if reset: self._stacks.clear(); self.samples = 0; self.started_at = time.time()
+        return "\n".join(lines) + "\n"
+
+    def stats(self):
+        return {"enabled": PROFILER_ENABLED, "running": bool(self._worker and self._worker.is_alive()),
+                "samples": self.samples, "stacks": len(self._stacks), "interval_ms": self.interval * 1000}
+
+PROFILER = SamplingProfiler()
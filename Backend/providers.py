@@ -0,0 +1,334 @@
+"""OpenRouter calls behind one resilience layer.
+
+Every call goes through its endpoint's `Endpoint`: a concurrency cap, a circuit
+breaker and rolling latency windows, one per call class. On top of that:
+- timeouts come from the request deadline (`request_deadline`), so a call never
+  outlives the request that made it;
+- retryable failures (transport errors, 408/429/5xx) are retried with jittered
+  exponential backoff, then the next model in OPENROUTER_FALLBACK_MODELS is tried
+  (chat only; embeddings must stay on one model to keep vector dimensions);
+- with PROVIDER_HEDGE=1 a second request is sent when the first is slower than the
+  recent p95 of the same class of call, and whichever answers first wins;
+- an open breaker fails fast with ProviderUnavailable, which /chat turns into the
+  canned safety reply.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional, List, Dict, AsyncIterator
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from metrics import provider_call, record_usage
+
+load_dotenv()
+
+# CONFIG
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_FALLBACK_MODELS = [m.strip() for m in os.getenv("OPENROUTER_FALLBACK_MODELS", "").split(",") if m.strip()]
+PROVIDER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", 60))
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", 10))
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", 100))
+PROVIDER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", 20))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", 30))
+PROVIDER_DEADLINE = float(os.getenv("PROVIDER_DEADLINE", 30))  # per-request budget for all provider calls
+PROVIDER_MIN_TIMEOUT = 0.5  # below this much budget a call is not worth starting
+PROVIDER_CHAT_CONCURRENCY = int(os.getenv("PROVIDER_CHAT_CONCURRENCY", 32))
+PROVIDER_EMBED_CONCURRENCY = int(os.getenv("PROVIDER_EMBED_CONCURRENCY", 16))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", 2))
+PROVIDER_BACKOFF = float(os.getenv("PROVIDER_BACKOFF", 0.2))
+PROVIDER_HEDGE = os.getenv("PROVIDER_HEDGE", "0") == "1"
+PROVIDER_HEDGE_DELAY = float(os.getenv("PROVIDER_HEDGE_DELAY", 2.0))  # until enough latencies are seen for a p95
+BREAKER_THRESHOLD = int(os.getenv("PROVIDER_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = float(os.getenv("PROVIDER_BREAKER_COOLDOWN", 30))
+
+CHAT_ENDPOINT = f"{OPENROUTER_BASE_URL}/chat/completions"
+EMBEDDINGS_ENDPOINT = f"{OPENROUTER_BASE_URL}/embeddings"
+HEADERS = {"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"}
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger("medisos")
+
+# One pooled client per process: keep-alive connections are reused across requests
+# instead of paying a TCP + TLS handshake on every provider call.
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(PROVIDER_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=PROVIDER_MAX_CONNECTIONS,
+                                max_keepalive_connections=PROVIDER_MAX_KEEPALIVE,
+                                keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY),
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+class ProviderUnavailable(HTTPException):
+    def __init__(self, detail: str = "LLM provider unavailable"):
+        super().__init__(status_code=503, detail=detail)
+
+# Deadlines
+_deadline: contextvars.ContextVar = contextvars.ContextVar("provider_deadline", default=None)
+
+@contextmanager
+def request_deadline(seconds: Optional[float] = PROVIDER_DEADLINE, at: Optional[float] = None):
+    """Provider calls made inside the block (and tasks it spawns) share one time budget;
+    `request_deadline(None)` lifts it, e.g. for background work started by a request."""
+    if at is None and seconds is not None: at = time.monotonic() + seconds
+    token = _deadline.set(at)
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+def remaining_budget() -> float:
+    deadline = _deadline.get()
+    if deadline is None: return PROVIDER_TIMEOUT
+    return min(PROVIDER_TIMEOUT, deadline - time.monotonic())
+
+def call_timeout(budget: float) -> httpx.Timeout:
+    budget = max(budget, PROVIDER_MIN_TIMEOUT)
+    return httpx.Timeout(budget, connect=min(PROVIDER_CONNECT_TIMEOUT, budget))
+
+# Per-endpoint limiter, breaker and latency windows
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` seconds one trial
+    call is let through (half-open) and its outcome closes or re-opens the breaker."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed": return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0; self.opened_at = None; self._trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            if self.opened_at is None or self._trial: self.trips += 1
+            self.opened_at = time.monotonic(); self._trial = False
+
+class Endpoint:
+    def __init__(self, name: str, url: str, concurrency: int):
+        self.name = name
+        self.url = url
+        self.concurrency = concurrency
+        self.breaker = CircuitBreaker()
+        self.latencies: Dict[str, deque] = {}  # call class -> recent durations
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.rejected = 0
+        self.hedges = 0
+
+    @asynccontextmanager
+    async def slot(self, budget: float):
+        # queueing for a slot counts against the deadline like the call itself
+        if self._sem is None: self._sem = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), budget)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="LLM provider busy")
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+    def record(self, call: str, seconds: float):
+        self.latencies.setdefault(call, deque(maxlen=200)).append(seconds)
+
+    def hedge_delay(self, call: str = "default") -> float:
+        window = self.latencies.get(call) or ()
+        if len(window) < 20: return PROVIDER_HEDGE_DELAY
+        ordered = sorted(window)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def stats(self) -> Dict:
+        return {"breaker_state": self.breaker.state, "breaker_open": self.breaker.state == "open",
+                "breaker_trips": self.breaker.trips, "consecutive_failures": self.breaker.failures,
+                "concurrency": self.concurrency, "waiting": self.waiting, "rejected": self.rejected,
+                "hedges": self.hedges, "p95_s": {call: self.hedge_delay(call) for call, w in self.latencies.items() if len(w) >= 20}}
+
+ENDPOINTS = {"chat": Endpoint("chat", CHAT_ENDPOINT, PROVIDER_CHAT_CONCURRENCY),
+             "embeddings": Endpoint("embeddings", EMBEDDINGS_ENDPOINT, PROVIDER_EMBED_CONCURRENCY)}
+
+def provider_stats() -> Dict:
+    return {name: ep.stats() for name, ep in ENDPOINTS.items()}
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError): return e.response.status_code in RETRY_STATUS
+    return isinstance(e, httpx.TransportError)
+
+def backoff(attempt: int) -> float:
+    # full jitter: retries from many requests don't land on the upstream together
+    return random.uniform(0, PROVIDER_BACKOFF * 2 ** attempt)
+
+def call_class(payload: Dict) -> str:
+    # an 80-token classifier verdict and a 512-token reply take very different times
+    return f"max_tokens_{payload['max_tokens']}" if "max_tokens" in payload else "default"
+
+def describe(e: Exception) -> str:
+    if isinstance(e, httpx.HTTPStatusError): return f"{e.response.status_code} {e.response.text[:200]}"
+    return repr(e)
+
+# Calls
+async def _attempt(ep: Endpoint, metric: str, payload: Dict, budget: float) -> Dict:
+    async with ep.slot(budget):
+        with provider_call(metric, payload["model"]):
+            start = time.monotonic()
+            r = await get_client().post(ep.url, json=payload, timeout=call_timeout(remaining_budget()))
+            r.raise_for_status()
+            ep.record(call_class(payload), time.monotonic() - start)
+            return r.json()
+
+async def _hedged(ep: Endpoint, metric: str, payload: Dict, budget: float) -> Dict:
+    if not PROVIDER_HEDGE: return await _attempt(ep, metric, payload, budget)
+    pending = {asyncio.create_task(_attempt(ep, metric, payload, budget))}
+    error = None
+    try:
+        done, _ = await asyncio.wait(pending, timeout=ep.hedge_delay(call_class(payload)))
+        if not done:
+            ep.hedges += 1
+            pending.add(asyncio.create_task(_attempt(ep, metric, payload, remaining_budget())))
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None: return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending: task.cancel()
+
+async def _call(name: str, metric: str, payload: Dict, models: List[str], retries: int = PROVIDER_RETRIES) -> Dict:
+    ep = ENDPOINTS[name]
+    last: Optional[Exception] = None
+    for model in models:
+        for attempt in range(retries + 1):
+            if not ep.breaker.allow(): raise ProviderUnavailable()
+            budget = remaining_budget()
+            if budget < PROVIDER_MIN_TIMEOUT: raise HTTPException(status_code=504, detail="LLM provider deadline exceeded")
+            try:
+                data = await _hedged(ep, metric, {**payload, "model": model}, budget)
+                ep.breaker.success()
+                return data
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                last = e
+                if not is_retryable(e):
+                    # e.g. 400/404 for this model: the upstream is healthy, try the next model
+                    ep.breaker.success()
+                    logger.error("OpenRouter %s error (%s): %s", metric, model, describe(e))
+                    break
+                ep.breaker.failure()
+                logger.warning("OpenRouter %s attempt %d (%s) failed: %s", metric, attempt + 1, model, describe(e))
+                if attempt < retries:
+                    await asyncio.sleep(min(backoff(attempt), max(remaining_budget() - PROVIDER_MIN_TIMEOUT, 0)))
+    logger.error("OpenRouter %s failed on %s: %s", metric, ", ".join(models), describe(last) if last else "no attempt")
+    raise HTTPException(status_code=502, detail=("Embeddings provider error" if name == "embeddings" else "LLM provider error"))
+
+def chat_models(model: str) -> List[str]:
+    return [model] + [m for m in OPENROUTER_FALLBACK_MODELS if m != model]
+
+async def call_openrouter_chat(messages: List[Dict], model="openrouter/auto", max_tokens=512, temperature=0.2):
+    if OPENROUTER_API_KEY is None:
+        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+    payload = {"messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+    data = await _call("chat", "chat", payload, chat_models(model))
+    record_usage("chat", data.get("usage"))
+    return data
+
+async def stream_openrouter_chat(messages: List[Dict], model="openrouter/auto", max_tokens=512, temperature=0.2) -> AsyncIterator[str]:
+    # yields content deltas from an OpenRouter `stream: true` completion; retries and
+    # fallback only apply until the first delta has been handed to the caller
+    if OPENROUTER_API_KEY is None:
+        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+    ep = ENDPOINTS["chat"]
+    for model in chat_models(model):
+        for attempt in range(PROVIDER_RETRIES + 1):
+            if not ep.breaker.allow(): raise ProviderUnavailable()
+            budget = remaining_budget()
+            if budget < PROVIDER_MIN_TIMEOUT: raise HTTPException(status_code=504, detail="LLM provider deadline exceeded")
+            payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature, "stream": True}
+            started = False
+            try:
+                async with ep.slot(budget):
+                    with provider_call("chat_stream", model):
+                        async with get_client().stream("POST", CHAT_ENDPOINT, json=payload, timeout=call_timeout(remaining_budget())) as r:
+                            if r.is_error:
+                                await r.aread()
+                                r.raise_for_status()
+                            async for line in r.aiter_lines():
+                                # the timeout above bounds each read, not a reply trickling in past the deadline
+                                if remaining_budget() <= 0:
+                                    logger.warning("OpenRouter chat stream (%s) cut off at the request deadline", model)
+                                    raise HTTPException(status_code=504, detail="LLM provider deadline exceeded")
+                                # skip blank separators and keep-alive comments (": OPENROUTER PROCESSING")
+                                if not line.startswith("data:"): continue
+                                data = line[5:].strip()
+                                if data == "[DONE]": break
+                                try:
+                                    chunk = json.loads(data)
+                                except ValueError:
+                                    continue
+                                # usage, when sent, rides on the last chunk
+                                record_usage("chat_stream", chunk.get("usage"))
+                                choices = chunk.get("choices") or [{}]
+                                delta = (choices[0].get("delta") or {}).get("content")
+                                if delta:
+                                    started = True
+                                    yield delta
+                ep.breaker.success()
+                return
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                logger.error("OpenRouter chat stream error (%s): %s", model, describe(e))
+                if not is_retryable(e):
+                    ep.breaker.success()
+                    break
+                ep.breaker.failure()
+                if started: raise HTTPException(status_code=502, detail="LLM provider error")
+                if attempt < PROVIDER_RETRIES:
+                    await asyncio.sleep(min(backoff(attempt), max(remaining_budget() - PROVIDER_MIN_TIMEOUT, 0)))
+    raise HTTPException(status_code=502, detail="LLM provider error")
+
+async def get_openrouter_embeddings(texts: List[str], model="text-embedding-3-large"):
+    if OPENROUTER_API_KEY is None:
+        raise HTTPException(status_code=500, detail="OpenRouter API key not configured")
+    data = await _call("embeddings", "embeddings", {"input": texts}, [model])
+    record_usage("embeddings", data.get("usage"))
+    return data.get("data", [])
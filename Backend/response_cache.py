@@ -0,0 +1,121 @@
+"""Opt-in semantic cache of /chat replies for repeated low-risk questions.
+
+Replies are keyed by the query embedding (the one retrieval already computed) in a
+small dedicated FAISS inner-product index over normalized vectors. A lookup hits
+when the cosine similarity is at least RESPONSE_CACHE_THRESHOLD and the entry was
+stored under the same scope: the prompt version plus the set of retrieved passages.
+Entries expire after RESPONSE_CACHE_TTL seconds and the least recently used are
+evicted past RESPONSE_CACHE_MAX. Callers decide eligibility; /chat only uses it for
+turns the risk pipeline rated low and that carry no conversation history.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from coldstart import lazy_import
+
+faiss = lazy_import("faiss")
+
+load_dotenv()
+
+# CONFIG
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", 5000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 86400))
+RESPONSE_CACHE_MAX_RISK = int(os.getenv("RESPONSE_CACHE_MAX_RISK", 30))
+RESPONSE_CACHE_CANDIDATES = 8
+
+def cache_scope(prompt_version: str, passages: List[str], profile: List[str] = ()) -> str:
+    # by passage text rather than chunk id: ids are positional, so an edited slide keeps its id;
+    # `profile` holds the prompt's user fields that are shared between users (age group, psychologist)
+    key = "\0".join([prompt_version, *sorted(passages), "\1", *[str(p or "") for p in profile]])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+class SemanticResponseCache:
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD, max_items: int = RESPONSE_CACHE_MAX, ttl: float = RESPONSE_CACHE_TTL):
+        self.threshold = threshold
+        self.max_items = max_items
+        self.ttl = ttl
+        self._index = None
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _prepare(vector) -> np.ndarray:
+        x = np.array([vector], dtype="float32")
+        faiss.normalize_L2(x)
+        return x
+
+    def _drop(self, ids: List[int]):
+        for i in ids: self._entries.pop(i, None)
+        if ids: self._index.remove_ids(np.array(ids, dtype="int64"))
+
+    def lookup(self, vector, scope: str) -> Optional[Dict]:
+        if faiss is None: return None
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0 or self._index.d != len(vector):
+                self.misses += 1
+                return None
+            sims, ids = self._index.search(self._prepare(vector), min(RESPONSE_CACHE_CANDIDATES, self._index.ntotal))
+            now = time.time(); expired = []
+            for sim, i in zip(sims[0], ids[0]):
+                if i < 0 or sim < self.threshold: break  # results come best-first
+                entry = self._entries.get(int(i))
+                if entry is None: continue
+                if now - entry["stored_at"] > self.ttl:
+                    expired.append(int(i)); continue
+                if entry["scope"] != scope: continue
+                self._entries.move_to_end(int(i))
+                self.hits += 1
+                self._drop(expired)
+                return {"reply": entry["reply"], "metadata": dict(entry["metadata"]), "similarity": float(sim)}
+            self._drop(expired)
+            self.misses += 1
+            return None
+
+    def store(self, vector, scope: str, reply: str, metadata: Dict):
+        if faiss is None: return
+        with self._lock:
+            if self._index is None or self._index.d != len(vector):
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(len(vector)))
+                self._entries.clear()
+            cid = self._next_id; self._next_id += 1
+            self._index.add_with_ids(self._prepare(vector), np.array([cid], dtype="int64"))
+            self._entries[cid] = {"scope": scope, "reply": reply, "metadata": dict(metadata), "stored_at": time.time()}
+            self.stores += 1
+            if len(self._entries) > self.max_items:
+                over = list(self._entries)[:len(self._entries) - self.max_items]
+                self._drop(over); self.evictions += len(over)
+
+    def clear(self):
+        with self._lock:
+            self._index = None; self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {"enabled": RESPONSE_CACHE_ENABLED, "items": len(self._entries), "max_items": self.max_items,
+                "hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0}
+
+RESPONSE_CACHE = SemanticResponseCache()
+
+def cacheable_risk(risk: Dict) -> bool:
+    # a fallback verdict means the message was never actually screened
+    if risk.get("reason") == "fallback": return False
+    return str(risk.get("label", "low")).lower() == "low" and int(risk.get("risk_score", 0) or 0) <= RESPONSE_CACHE_MAX_RISK
+
+def mentions_any(text: str, names: List[str]) -> bool:
+    return any(n and re.search(rf"(?<!\w){re.escape(n)}(?!\w)", text, re.IGNORECASE) for n in names)
@@ -0,0 +1,198 @@
+"""Tiered risk screening for chat messages.
+
+1. Keyword tier: one compiled regex over the normalized URGENT_KEYWORDS.
+2. Local tier: small-talk allowlist plus an optional hashed n-gram logistic model
+   with calibrated low/high thresholds (trained offline, see `python risk.py -h`).
+3. LLM tier: the provider classifier, only for messages in the uncertain band.
+"""
+import os
+import re
+import json
+import zlib
+import logging
+import argparse
+import threading
+from typing import Optional, List, Dict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from providers import call_openrouter_chat
+
+load_dotenv()
+
+# CONFIG
+RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH", "./risk_model.json")
+RISK_ESCALATE_SCORE = 70  # at or above this /chat answers with the safety reply
+
+logger = logging.getLogger("medisos")
+
+URGENT_KEYWORDS = ["kill myself","I want to die","End my life","suicide","hurt myself","It's over for me","I feel like jumping from the roof","Die","hang myself"]
+SMALL_TALK = ["hi","hello","hey","hi there","hello there","thanks","thank you","thanks a lot","thank you so much","ok","okay",
+              "bye","goodbye","good morning","good afternoon","good evening","good night","yes","no","sure","cool","great"]
+
+def normalize(text: str) -> str:
+    text = text.casefold().replace("’", "'").replace("‘", "'")
+    return " ".join(text.split())
+
+def compile_keywords(keywords: List[str]) -> "re.Pattern":
+    # normalize the patterns the same way as the text, so mixed-case entries match;
+    # word boundaries keep "die" from firing on "diet" or "studies"
+    alternatives = sorted({re.escape(normalize(k)) for k in keywords}, key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)")
+
+URGENT_PATTERN = compile_keywords(URGENT_KEYWORDS)
+SMALL_TALK_SET = {normalize(s) for s in SMALL_TALK}
+
+# per-tier counters
+_COUNTER_LOCK = threading.Lock()
+RISK_COUNTERS: Dict[str, int] = {"keyword": 0, "small_talk": 0, "scorer_low": 0, "scorer_high": 0, "llm": 0, "llm_fallback": 0}
+
+def _count(tier: str):
+    with _COUNTER_LOCK:
+        RISK_COUNTERS[tier] += 1
+
+def risk_stats() -> Dict:
+    with _COUNTER_LOCK:
+        counts = dict(RISK_COUNTERS)
+    screened = sum(v for k, v in counts.items() if k != "llm_fallback")
+    local = screened - counts["llm"]
+    return {"counts": counts, "screened": screened, "llm_skip_rate": (local / screened) if screened else 0.0,
+            "scorer_loaded": RISK_SCORER is not None}
+
+def quick_urgent_check(text: str) -> bool:
+    hit = URGENT_PATTERN.search(normalize(text)) is not None
+    if hit: _count("keyword")
+    return hit
+
+# Local scorer
+class NgramRiskScorer:
+    """Logistic regression over hashed word 1- and 2-grams.
+
+    `low` and `high` are probability thresholds picked on held-out data: below `low`
+    a message is treated as low risk without asking the LLM, at or above `high` it
+    escalates straight away, anything between goes to the LLM classifier.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float, low: float, high: float):
+        self.weights = np.asarray(weights, dtype="float32")
+        self.bias = float(bias)
+        self.low = low
+        self.high = high
+
+    @property
+    def n_features(self) -> int:
+        return len(self.weights)
+
+    @staticmethod
+    def features(text: str, n_features: int) -> np.ndarray:
+        words = re.findall(r"[\w']+", normalize(text))
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return np.unique(np.array([zlib.crc32(g.encode("utf-8")) % n_features for g in grams], dtype="int64"))
+
+    def score(self, text: str) -> float:
+        z = self.bias + float(self.weights[self.features(text, self.n_features)].sum())
+        return float(1.0 / (1.0 + np.exp(-z)))
+
+    def save(self, path: str):
+        nz = np.nonzero(self.weights)[0]
+        with open(path, "w") as f:
+            json.dump({"n_features": self.n_features, "bias": self.bias, "low": self.low, "high": self.high,
+                       "weights": {str(int(i)): float(self.weights[i]) for i in nz}}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "NgramRiskScorer":
+        with open(path) as f:
+            data = json.load(f)
+        weights = np.zeros(int(data["n_features"]), dtype="float32")
+        for i, w in data["weights"].items(): weights[int(i)] = w
+        return cls(weights, data["bias"], data["low"], data["high"])
+
+    @classmethod
+    def fit(cls, texts: List[str], labels: List[int], n_features: int = 1 << 18, epochs: int = 20, lr: float = 0.5, l2: float = 1e-5):
+        feats = [cls.features(t, n_features) for t in texts]
+        y = np.asarray(labels, dtype="float32")
+        w = np.zeros(n_features, dtype="float32"); b = 0.0
+        order = np.arange(len(texts)); rng = np.random.default_rng(0)
+        for _ in range(epochs):
+            rng.shuffle(order)
+            for i in order:
+                p = 1.0 / (1.0 + np.exp(-(b + w[feats[i]].sum())))
+                g = p - y[i]
+                w[feats[i]] -= lr * (g + l2 * w[feats[i]]); b -= lr * g
+        return cls(w, b, 0.0, 1.0)
+
+    def calibrate(self, texts: List[str], labels: List[int], max_missed: float = 0.01, min_precision: float = 0.95):
+        """Pick `low` so at most `max_missed` of risky messages score under it, and
+        `high` as the lowest threshold whose precision is at least `min_precision`."""
+        scores = np.array([self.score(t) for t in texts]); y = np.asarray(labels)
+        pos = np.sort(scores[y == 1])
+        self.low = float(pos[int(np.floor(max_missed * len(pos)))]) if len(pos) else 0.0
+        self.high = 1.0
+        for t in np.unique(scores)[::-1]:
+            sel = scores >= t
+            if y[sel].mean() < min_precision: break
+            self.high = float(t)
+        return self
+
+def load_scorer(path: str = RISK_MODEL_PATH) -> Optional[NgramRiskScorer]:
+    if not path or not os.path.exists(path): return None
+    try:
+        return NgramRiskScorer.load(path)
+    except Exception as e:
+        logger.warning("Risk model %s not loaded: %s", path, e)
+        return None
+
+RISK_SCORER = load_scorer()
+
+def local_risk_screen(text: str) -> Optional[dict]:
+    """Tier 2: a decision when the message is clearly low or clearly high risk, else None."""
+    if normalize(text).strip(" .!?") in SMALL_TALK_SET:
+        _count("small_talk")
+        return {"risk_score": 0, "label": "low", "reason": "small talk", "tier": "small_talk"}
+    if RISK_SCORER is None: return None
+    p = RISK_SCORER.score(text)
+    if p < RISK_SCORER.low:
+        _count("scorer_low")
+        return {"risk_score": int(round(p * 100)), "label": "low", "reason": "local scorer", "tier": "scorer"}
+    if p >= RISK_SCORER.high:
+        _count("scorer_high")
+        return {"risk_score": max(RISK_ESCALATE_SCORE, int(round(p * 100))), "label": "high", "reason": "local scorer", "tier": "scorer"}
+    return None
+
+async def llm_classify_risk(text: str) -> dict:
+    _count("llm")
+    system = ("You are a safety classifier. Given a user message return ONLY JSON: "
+              '{"risk_score":int,"label":"low|medium|high","reason":"short"}')
+    messages = [{"role":"system","content":system}, {"role":"user","content":f'Classify:\n"""\n{text}\n"""'}]
+    try:
+        resp = await call_openrouter_chat(messages, max_tokens=80, temperature=0.0)
+        assistant_text = resp["choices"][0]["message"]["content"]
+        s = assistant_text.find("{"); e = assistant_text.rfind("}")
+        if s != -1 and e != -1 and e > s:
+            return json.loads(assistant_text[s:e+1])
+    except Exception as e:
+        logger.warning("LLM risk classify failed: %s", e)
+    _count("llm_fallback")
+    return {"risk_score":0,"label":"low","reason":"fallback"}
+
+def main():
+    ap = argparse.ArgumentParser(description="Train and calibrate the local risk scorer.")
+    ap.add_argument("train", help="JSONL with {\"text\": ..., \"label\": 0|1} rows (e.g. past LLM classifications)")
+    ap.add_argument("--holdout", help="JSONL used for threshold calibration (default: train file)")
+    ap.add_argument("--out", default=RISK_MODEL_PATH)
+    ap.add_argument("--max-missed", type=float, default=0.01, help="share of risky messages allowed under the low threshold")
+    ap.add_argument("--min-precision", type=float, default=0.95, help="precision required above the high threshold")
+    args = ap.parse_args()
+    def read(path):
+        with open(path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [r["text"] for r in rows], [int(r["label"]) for r in rows]
+    texts, labels = read(args.train)
+    scorer = NgramRiskScorer.fit(texts, labels)
+    scorer.calibrate(*read(args.holdout or args.train), max_missed=args.max_missed, min_precision=args.min_precision)
+    scorer.save(args.out)
+    print(json.dumps({"out": args.out, "low": scorer.low, "high": scorer.high, "examples": len(texts)}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Rolling per-session summaries.
+
+Instead of sending the whole transcript to the LLM when a session ends, every
+session keeps a running summary plus a risk aggregate. After a chat turn, once
+SUMMARY_EVERY_TURNS turns have piled up since the last update, a background task
+folds the new messages into the summary. Long backlogs are summarized map-reduce
+style: chunks in parallel, then one merge. /end_session only has to fold in the
+few messages since the last update.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Optional, List, Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import func
+
+from db import SessionLocal
+from models import Session, Message
+from providers import call_openrouter_chat, request_deadline
+from context import CONTEXT_CACHE
+
+load_dotenv()
+
+# CONFIG
+SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", 4))
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", 8000))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", 4))
+
+logger = logging.getLogger("medisos")
+
+SUMMARY_SCHEMA = "{\"summary\":\"...\",\"risk_score\":int,\"urgency\":\"high|moderate|normal\"}"
+
+def parse_summary_json(assistant_text: str) -> Dict:
+    s = assistant_text.find("{"); e = assistant_text.rfind("}")
+    if s != -1 and e != -1 and e > s:
+        try:
+            return json.loads(assistant_text[s:e+1])
+        except Exception:
+            pass
+    return {"summary": assistant_text, "risk_score":0, "urgency":"normal"}
+
+async def _complete_json(system: str, user: str, max_tokens: int) -> Dict:
+    messages = [{"role":"system","content":system}, {"role":"user","content":user}]
+    resp = await call_openrouter_chat(messages, max_tokens=max_tokens, temperature=0.0)
+    return parse_summary_json(resp["choices"][0]["message"]["content"])
+
+async def summarize_chunk(transcript: str) -> Dict:
+    # map step: one slice of a long backlog
+    system = ("You are Mental health Assessment summarizer. Summarize this part of a conversation. Return ONLY JSON: " + SUMMARY_SCHEMA)
+    return await _complete_json(system, f"Conversation part:\n\n{transcript}\n\nReturn JSON.", max_tokens=300)
+
+async def merge_summary(previous: Optional[Dict], new_material: str, material_is_notes: bool) -> Dict:
+    # reduce step: fold new messages (or per-chunk notes) into the running summary
+    system = ("You are Mental health Assessment summarizer. You maintain a running summary of one conversation. "
+              "Update it with the new material and return ONLY JSON: " + SUMMARY_SCHEMA)
+    prev = json.dumps(previous) if previous else "(none yet)"
+    label = "Notes on the newer parts of the conversation" if material_is_notes else "New messages"
+    return await _complete_json(system, f"Summary so far:\n{prev}\n\n{label}:\n\n{new_material}\n\nReturn JSON.", max_tokens=400)
+
+def chunk_transcript(lines: List[str], max_chars: int = SUMMARY_CHUNK_CHARS) -> List[str]:
+    chunks, cur, size = [], [], 0
+    for line in lines:
+        if cur and size + len(line) > max_chars:
+            chunks.append("\n\n".join(cur)); cur, size = [], 0
+        cur.append(line[:max_chars]); size += len(line) + 2
+    if cur: chunks.append("\n\n".join(cur))
+    return chunks
+
+# DB side (runs in the threadpool with its own session: callers may be background tasks)
+def session_state(s: Session) -> Dict:
+    previous = None
+    if s.summary is not None:
+        previous = {"summary": s.summary, "risk_score": s.summary_risk_score or 0, "urgency": s.summary_urgency or "normal"}
+    return {"previous": previous, "upto": s.summary_upto_id or 0, "risk_max": s.risk_max,
+            "risk_total": s.risk_total or 0, "risk_count": s.risk_count or 0}
+
+def load_backlog(session_id: int):
+    db = SessionLocal()
+    try:
+        s = db.query(Session).get(session_id)
+        if s is None: return None, []
+        state = session_state(s)
+        rows = (db.query(Message.id, Message.sender, Message.text, Message.risk_score)
+                .filter(Message.session_id == session_id, Message.id > state["upto"])
+                .order_by(Message.id.asc()).all())
+        return state, rows
+    finally:
+        db.close()
+
+def count_unsummarized(session_id: int) -> int:
+    db = SessionLocal()
+    try:
+        upto = db.query(func.coalesce(Session.summary_upto_id, 0)).filter(Session.id == session_id).scalar()
+        if upto is None: return 0
+        return db.query(func.count(Message.id)).filter(Message.session_id == session_id, Message.id > upto).scalar()
+    finally:
+        db.close()
+
+def save_summary(session_id: int, expected_upto: int, values: Dict) -> bool:
+    # compare-and-set on summary_upto_id: if another worker got there first, keep theirs
+    db = SessionLocal()
+    try:
+        n = (db.query(Session)
+             .filter(Session.id == session_id, func.coalesce(Session.summary_upto_id, 0) == expected_upto)
+             .update(values, synchronize_session=False))
+        db.commit()
+        return n == 1
+    finally:
+        db.close()
+
+# per-session lock with a user count, so idle sessions don't leave locks behind
+_locks: Dict[int, list] = {}
+_tasks = set()
+
+async def update_session_summary(session_id: int) -> Optional[Dict]:
+    """Fold every message not yet summarized into the session's running state.
+
+    Returns {"summary", "risk_score", "urgency", "risk_max", "risk_mean"}, or None if
+    the session does not exist.
+    """
+    entry = _locks.setdefault(session_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            state, rows = await asyncio.to_thread(load_backlog, session_id)
+            if state is None: return None
+            summary = state["previous"]
+            if rows:
+                lines = [f"{r.sender}: {r.text}" for r in rows]
+                chunks = chunk_transcript(lines)
+                if len(chunks) == 1:
+                    summary = await merge_summary(summary, chunks[0], material_is_notes=False)
+                else:
+                    sem = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+                    async def one(chunk):
+                        async with sem: return await summarize_chunk(chunk)
+                    parts = await asyncio.gather(*[one(c) for c in chunks])
+                    notes = "\n\n".join(f"Part {i+1}: {p.get('summary','')} (risk_score={p.get('risk_score',0)}, urgency={p.get('urgency','normal')})"
+                                        for i, p in enumerate(parts))
+                    summary = await merge_summary(summary, notes, material_is_notes=True)
+                scores = [r.risk_score for r in rows if r.risk_score is not None]
+                if scores:
+                    state["risk_max"] = max([state["risk_max"] or 0, *scores])
+                    state["risk_total"] += sum(scores); state["risk_count"] += len(scores)
+                saved = await asyncio.to_thread(save_summary, session_id, state["upto"], {
+                    "summary": summary.get("summary", ""), "summary_risk_score": int(summary.get("risk_score", 0) or 0),
+                    "summary_urgency": summary.get("urgency", "normal"), "summary_upto_id": rows[-1].id,
+                    "risk_max": state["risk_max"], "risk_total": state["risk_total"], "risk_count": state["risk_count"]})
+                if saved:
+                    CONTEXT_CACHE.set_summary(session_id, summary.get("summary", ""))
+                else:
+                    logger.info("Session %s summary advanced elsewhere; reloading", session_id)
+                    state, _ = await asyncio.to_thread(load_backlog, session_id)
+                    summary = state["previous"]
+            summary = dict(summary or {"summary": "", "risk_score": 0, "urgency": "normal"})
+            summary["risk_max"] = state["risk_max"] or 0
+            summary["risk_mean"] = (state["risk_total"] / state["risk_count"]) if state["risk_count"] else 0.0
+            return summary
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0: _locks.pop(session_id, None)
+
+async def refresh_if_due(session_id: int):
+    # the task inherits the request's context; its provider calls are not bound by that deadline
+    try:
+        with request_deadline(None):
+            if await asyncio.to_thread(count_unsummarized, session_id) >= 2 * SUMMARY_EVERY_TURNS:
+                await update_session_summary(session_id)
+    except Exception as e:
+        logger.warning("Background summary of session %s failed: %s", session_id, e)
+
+def schedule_summary_refresh(session_id: int):
+    """Fire-and-forget from a request handler; the task holds no request state."""
+    task = asyncio.create_task(refresh_if_due(session_id))
+    _tasks.add(task); task.add_done_callback(_tasks.discard)
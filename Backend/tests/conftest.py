@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# the backend uses flat imports and reads its config from the environment at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("EMBED_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "embeddings_cache.sqlite3"))
+os.environ.setdefault("RISK_MODEL_PATH", "")
+os.environ.setdefault("OPENROUTER_API_KEY", "test")
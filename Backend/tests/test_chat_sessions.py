@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+
+import app
+from db import SessionLocal
+from migrate import migrate
+from models import User, Session, Message
+
+def make_user(db, email):
+    user = User(first_name="Test", last_name="User", email=email, password_hash="x")
+    db.add(user); db.commit(); db.refresh(user)
+    return SimpleNamespace(id=user.id, psychologist_id=None)
+
+def test_history_only_comes_from_the_callers_own_session():
+    migrate()
+    db = SessionLocal()
+    try:
+        alice, eve = make_user(db, "alice@example.com"), make_user(db, "eve@example.com")
+        first = app.start_chat_turn(db, None, alice, "something private")
+        # a foreign id is treated like an invalid one: a fresh session, no history
+        foreign = app.start_chat_turn(db, first["session_id"], eve, "what did they say?")
+        assert foreign["session_id"] != first["session_id"] and foreign["history"] is None
+        anonymous = app.start_chat_turn(db, first["session_id"], None, "and now?")
+        assert anonymous["session_id"] not in (first["session_id"], foreign["session_id"]) and anonymous["history"] is None
+        assert db.get(Session, foreign["session_id"]).user_id == eve.id
+        assert [m.text for m in db.query(Message).filter(Message.session_id == first["session_id"])] == ["something private"]
+        # the owner still continues their session, and anonymous sessions stay open to anonymous callers
+        again = app.start_chat_turn(db, first["session_id"], alice, "more")
+        assert again["session_id"] == first["session_id"] and again["history"] is not None
+        assert app.start_chat_turn(db, anonymous["session_id"], None, "hi")["session_id"] == anonymous["session_id"]
+    finally:
+        db.close()
+
+def test_stream_failure_after_deltas_keeps_the_partial_reply(monkeypatch):
+    async def flaky_stream(messages, **kwargs):
+        yield "I hear you, "; yield "that sounds hard"
+        raise HTTPException(status_code=502, detail="LLM provider error")
+    monkeypatch.setattr(app, "stream_openrouter_chat", flaky_stream)
+    migrate()
+    db = SessionLocal()
+    try:
+        turn = app.start_chat_turn(db, None, None, "rough week")
+    finally:
+        db.close()
+    turn.update(risk={"risk_score": 10}, messages=[], deadline=None)
+    async def consume():
+        return [e async for e in app.chat_event_stream(turn)]
+    events = asyncio.run(consume())
+    assert events[-1].startswith("event: error")
+    db = SessionLocal()
+    try:
+        stored = [(m.sender, m.text) for m in db.query(Message).filter(Message.session_id == turn["session_id"]).order_by(Message.id)]
+    finally:
+        db.close()
+    assert stored == [("user", "rough week"), ("assistant", "I hear you, that sounds hard")]
@@ -0,0 +1,32 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import embeddings
+
+class ShortBackend:
+    cache_model = "test-short-backend"
+
+    async def embed(self, texts):
+        # drops the last input, like a provider truncating a batch
+        return [np.ones(4, dtype="float32") for _ in texts[:-1]]
+
+def test_short_provider_response_is_a_502(monkeypatch):
+    monkeypatch.setitem(embeddings._BACKENDS, "short", ShortBackend())
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(embeddings.embed_texts(["first text", "second text"], backend="short"))
+    assert e.value.status_code == 502
+
+def test_disk_tier_is_trimmed_every_few_writes(tmp_path):
+    cache = embeddings.EmbeddingCache(db_path=str(tmp_path / "cache.sqlite3"), disk_max=5, evict_every=3)
+    def rows():
+        return cache._db().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    vec = np.ones(4, dtype="float32")
+    cache.put_many("m", [f"first {i}" for i in range(6)], [vec] * 6)
+    assert rows() == 5  # the first write checks
+    cache.put_many("m", ["second"], [vec]); cache.put_many("m", ["third"], [vec])
+    assert rows() == 7  # in between, no COUNT(*) per write
+    cache.put_many("m", ["fourth"], [vec])
+    assert rows() == 5 and cache.get_many("m", ["fourth"])[0] is not None
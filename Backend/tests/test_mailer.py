@@ -0,0 +1,98 @@
+import smtplib
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import mailer
+from db import Base
+from models import OutboxEmail
+
+class StubConnection:
+    """Stands in for SMTPConnection: each send takes the next scripted outcome."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = []
+        self.closes = 0
+        self.connects = 0
+
+    def send(self, sender, to_email, message):
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if outcome is not None: raise outcome
+        self.sent.append(to_email)
+
+    def close_if_idle(self, idle_seconds): pass
+
+    def close(self):
+        self.closes += 1
+
+@pytest.fixture
+def outbox(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    def add(n=1, **fields):
+        db = factory()
+        rows = [OutboxEmail(to_email=f"psych{i}@example.com", subject="Report", body="body", **fields) for i in range(n)]
+        db.add_all(rows); db.commit(); db.close()
+        return [r.id for r in rows]
+    def rows():
+        db = factory()
+        try:
+            return {r.id: r for r in db.query(OutboxEmail).order_by(OutboxEmail.id)}
+        finally:
+            db.close()
+    return factory, add, rows
+
+def dispatcher(factory, *outcomes):
+    return mailer.EmailDispatcher(session_factory=factory, connection=StubConnection(*outcomes), batch=10)
+
+def test_sent_row_is_marked_sent(outbox):
+    factory, add, rows = outbox
+    (rid,) = add()
+    d = dispatcher(factory)
+    assert d.run_once() == 1
+    row = rows()[rid]
+    assert row.status == "sent" and row.attempts == 1 and row.sent_at is not None and d.conn.sent == [row.to_email]
+    assert d.run_once() == 0  # nothing due any more
+
+def test_transient_failure_is_rescheduled_with_backoff(outbox):
+    factory, add, rows = outbox
+    (rid,) = add()
+    d = dispatcher(factory, smtplib.SMTPDataError(451, b"try again later"))
+    before = datetime.utcnow()
+    d.run_once()
+    row = rows()[rid]
+    assert row.status == "pending" and row.attempts == 1 and d.retried == 1
+    assert row.next_attempt_at >= before + timedelta(seconds=0.5 * mailer.EMAIL_RETRY_BASE)
+    assert d.run_once() == 0  # not due yet
+
+def test_permanent_rejection_fails_at_once(outbox):
+    factory, add, rows = outbox
+    (rid,) = add()
+    d = dispatcher(factory, smtplib.SMTPDataError(550, b"mailbox unavailable"))
+    d.run_once()
+    row = rows()[rid]
+    assert row.status == "failed" and row.attempts == 1 and "mailbox unavailable" in row.last_error and d.failed == 1
+
+def test_disconnect_releases_the_rest_of_the_batch(outbox):
+    factory, add, rows = outbox
+    ids = add(3)
+    d = dispatcher(factory, smtplib.SMTPServerDisconnected("gone"))
+    assert d.run_once() == 3
+    first, *rest = [rows()[i] for i in ids]
+    assert first.status == "pending" and first.attempts == 1 and d.conn.closes == 1
+    # the others were never tried against the dead server, and wait as long as the first
+    assert d.conn.sent == []
+    assert all(r.status == "pending" and r.attempts == 0 and r.next_attempt_at == first.next_attempt_at for r in rest)
+
+def test_expired_lease_is_taken_over(outbox):
+    factory, add, rows = outbox
+    now = datetime.utcnow()
+    (stuck,) = add(status="sending", claimed_at=now - timedelta(seconds=mailer.EMAIL_CLAIM_LEASE + 1))
+    (busy,) = add(status="sending", claimed_at=now)  # another worker is sending this one right now
+    d = dispatcher(factory)
+    assert d.run_once() == 1
+    assert rows()[stuck].status == "sent" and rows()[busy].status == "sending"
@@ -0,0 +1,23 @@
+from sqlalchemy import create_engine, text
+
+from db import Base
+from migrate import pending_changes, migrate
+
+def test_changed_index_columns_are_detected_and_rebuilt(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # an older deploy's version of the index, without the tie-breaking id
+        conn.execute(text("DROP INDEX ix_messages_session_created"))
+        conn.execute(text("CREATE INDEX ix_messages_session_created ON messages (session_id, created_at)"))
+    changes = pending_changes(engine)
+    assert changes == [{"op": "recreate_index", "table": "messages", "index": "ix_messages_session_created",
+                        "from": ["session_id", "created_at"], "to": ["session_id", "created_at", "id"]}]
+    migrate(engine)
+    assert pending_changes(engine) == []
+
+def test_fresh_database_is_created(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+    assert {c["op"] for c in pending_changes(engine)} == {"create_table"}
+    migrate(engine)
+    assert pending_changes(engine) == []
@@ -0,0 +1,24 @@
+import os
+import asyncio
+
+import passwords
+
+def _crash():
+    os._exit(1)
+
+def test_broken_pool_is_replaced():
+    async def scenario():
+        pool = passwords.get_pool()
+        # kill a worker the way an OOM kill would; the executor is now broken
+        try:
+            await asyncio.get_running_loop().run_in_executor(pool, _crash)
+        except Exception:
+            pass
+        hashed = await passwords.hash_password("secret")
+        assert await passwords.verify_password("secret", hashed)
+        assert not await passwords.verify_password("wrong", hashed)
+    try:
+        asyncio.run(scenario())
+        assert passwords.COUNTERS["pool_restarts"] >= 1
+    finally:
+        passwords.shutdown_pool()
@@ -0,0 +1,151 @@
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+import uvicorn
+from fastapi import HTTPException
+
+import providers
+from bench import fake_provider
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+@pytest.fixture(scope="module")
+def fake_url():
+    # the real fake provider on a local port, so timeouts behave like the network's
+    sock = socket.socket(); sock.bind(("127.0.0.1", 0)); port = sock.getsockname()[1]; sock.close()
+    server = uvicorn.Server(uvicorn.Config(fake_provider.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True); thread.start()
+    while not server.started: time.sleep(0.02)
+    yield f"http://127.0.0.1:{port}/api/v1"
+    server.should_exit = True; thread.join(5)
+
+@pytest.fixture
+def provider(fake_url, monkeypatch):
+    defaults = dict(fake_provider.CONFIG)
+    fake_provider.CONFIG.update(latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, slow_rate=0.0, slow_first_n=0, chunk_ms=0.0)
+    for key in fake_provider.STATS: fake_provider.STATS[key] = 0
+    monkeypatch.setattr(providers, "PROVIDER_BACKOFF", 0.01)
+    monkeypatch.setattr(providers, "CHAT_ENDPOINT", f"{fake_url}/chat/completions")
+    for name, ep in providers.ENDPOINTS.items():
+        monkeypatch.setattr(ep, "url", f"{fake_url}/{'chat/completions' if name == 'chat' else 'embeddings'}")
+        monkeypatch.setattr(ep, "breaker", providers.CircuitBreaker(threshold=3, cooldown=0.3))
+        monkeypatch.setattr(ep, "latencies", {})
+        ep.hedges = 0
+    yield providers.ENDPOINTS["chat"]
+    fake_provider.CONFIG.clear(); fake_provider.CONFIG.update(defaults)
+
+def run(coro):
+    async def wrapped():
+        try:
+            return await coro
+        finally:
+            # the pooled client belongs to this event loop
+            await providers.close_client()
+    return asyncio.run(wrapped())
+
+def test_breaker_state_transitions(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(providers.time, "monotonic", lambda: now[0])
+    b = providers.CircuitBreaker(threshold=2, cooldown=10)
+    b.failure(); assert b.state == "closed" and b.allow()
+    b.failure(); assert b.state == "open" and not b.allow() and b.trips == 1
+    now[0] += 10
+    assert b.state == "half_open"
+    assert b.allow() and not b.allow()  # exactly one trial call
+    b.failure(); assert b.state == "open" and b.trips == 2
+    now[0] += 10
+    assert b.allow(); b.success()
+    assert b.state == "closed" and b.failures == 0 and b.allow()
+
+def test_success_passes_through(provider):
+    data = run(providers.call_openrouter_chat(MESSAGES))
+    assert "Thank you" in data["choices"][0]["message"]["content"]
+    assert provider.breaker.state == "closed"
+
+def test_retries_then_breaker_opens_and_recovers(provider):
+    fake_provider.CONFIG.update(error_rate=1.0, error_status=503)
+    with pytest.raises(HTTPException) as e:
+        run(providers.call_openrouter_chat(MESSAGES))
+    # PROVIDER_RETRIES retries, and the third consecutive failure trips the breaker
+    assert e.value.status_code == 502 and fake_provider.STATS["errors"] == providers.PROVIDER_RETRIES + 1
+    assert provider.breaker.state == "open"
+    served = fake_provider.STATS["errors"]
+    with pytest.raises(providers.ProviderUnavailable):
+        run(providers.call_openrouter_chat(MESSAGES))
+    assert fake_provider.STATS["errors"] == served  # failed fast, the upstream was not called
+    fake_provider.CONFIG.update(error_rate=0.0)
+    time.sleep(0.35)
+    run(providers.call_openrouter_chat(MESSAGES))  # the half-open trial succeeds
+    assert provider.breaker.state == "closed"
+
+def test_client_errors_are_not_retried_and_do_not_trip(provider):
+    fake_provider.CONFIG.update(error_rate=1.0, error_status=400)
+    with pytest.raises(HTTPException) as e:
+        run(providers.call_openrouter_chat(MESSAGES))
+    assert e.value.status_code == 502 and fake_provider.STATS["errors"] == 1
+    assert provider.breaker.state == "closed" and provider.breaker.failures == 0
+
+def test_hedge_answers_from_the_faster_request(provider, monkeypatch):
+    monkeypatch.setattr(providers, "PROVIDER_HEDGE", True)
+    monkeypatch.setattr(providers, "PROVIDER_HEDGE_DELAY", 0.1)
+    fake_provider.CONFIG.update(slow_first_n=1, slow_ms=2000.0)  # only the first request is stuck
+    start = time.monotonic()
+    data = run(providers.call_openrouter_chat(MESSAGES))
+    assert time.monotonic() - start < 1.0
+    assert data["choices"] and fake_provider.STATS["slow"] == 1 and provider.hedges == 1
+
+def test_hedge_delay_is_kept_per_call_class():
+    ep = providers.Endpoint("test", "http://unused", 1)
+    reply, verdict = providers.call_class({"max_tokens": 512}), providers.call_class({"max_tokens": 80})
+    for i in range(20):
+        ep.record(reply, 4.0 + i * 0.01); ep.record(verdict, 0.3)
+    assert ep.hedge_delay(reply) >= 4.0 and ep.hedge_delay(verdict) == 0.3
+    assert ep.hedge_delay(providers.call_class({"input": ["x"]})) == providers.PROVIDER_HEDGE_DELAY
+    assert set(ep.stats()["p95_s"]) == {"max_tokens_512", "max_tokens_80"}
+
+def test_deadline_bounds_the_whole_call(provider):
+    fake_provider.CONFIG.update(latency_ms=3000.0)
+    async def call():
+        with providers.request_deadline(1.0):
+            return await providers.call_openrouter_chat(MESSAGES)
+    start = time.monotonic()
+    with pytest.raises(HTTPException) as e:
+        run(call())
+    # one attempt times out at the deadline; no budget is left for a retry
+    assert e.value.status_code == 504 and time.monotonic() - start < 1.6
+
+def test_deadline_cuts_off_a_trickling_stream(provider):
+    fake_provider.CONFIG.update(chunk_ms=300.0, stream_chunks=10)  # every read is quick, the whole reply is not
+    deltas = []
+    async def consume():
+        with providers.request_deadline(1.0):
+            async for d in providers.stream_openrouter_chat(MESSAGES): deltas.append(d)
+    start = time.monotonic()
+    with pytest.raises(HTTPException) as e:
+        run(consume())
+    assert e.value.status_code == 504 and time.monotonic() - start < 1.6
+    assert 0 < len(deltas) < 10
+
+def test_deadline_propagates_to_spawned_tasks():
+    async def scenario():
+        with providers.request_deadline(5.0):
+            inside = await asyncio.create_task(asyncio.sleep(0, providers.remaining_budget()))
+        with providers.request_deadline(None):
+            lifted = providers.remaining_budget()
+        return inside, lifted
+    inside, lifted = asyncio.run(scenario())
+    assert 4.0 < inside <= 5.0 and lifted == providers.PROVIDER_TIMEOUT
+
+def test_stream_falls_back_to_error_before_first_delta(provider):
+    fake_provider.CONFIG.update(error_rate=1.0, error_status=502)
+    async def consume():
+        return [d async for d in providers.stream_openrouter_chat(MESSAGES)]
+    with pytest.raises(HTTPException) as e:
+        run(consume())
+    assert e.value.status_code == 502 and fake_provider.STATS["errors"] == providers.PROVIDER_RETRIES + 1
+    fake_provider.CONFIG.update(error_rate=0.0)
+    provider.breaker.success()
+    assert "".join(run(consume())).startswith("Thank you")
@@ -0,0 +1,79 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import RAG
+import embeddings
+
+def corpus(n=10000, d=32, seed=0):
+    # ivf_pq needs 39 * 2**nbits training points
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, d)).astype("float32")
+
+@pytest.mark.parametrize("index_type", RAG.INDEX_TYPES)
+def test_every_index_type_publishes_and_loads(tmp_path, index_type):
+    xb = corpus()
+    ids = np.arange(len(xb), dtype="int64")
+    index = RAG.build_index(xb, ids, index_type, "l2")
+    RAG.publish_snapshot(index, {int(i): f"passage {i}" for i in ids[:50]}, str(tmp_path))
+    store = RAG.RetrievalStore(str(tmp_path))
+    assert store.refresh()
+    assert store.stats()["loaded"] and store.stats()["vectors"] == len(xb)
+    with store.use() as snapshot:
+        _, I = snapshot.index.search(RAG.prepare_vectors(xb[:1], snapshot.metric), 3)
+        assert I[0][0] >= 0
+
+def test_swapped_out_snapshot_closes_after_last_search(tmp_path):
+    xb = corpus(200)
+    ids = np.arange(len(xb), dtype="int64")
+    docs = {int(i): f"passage {i}" for i in ids}
+    RAG.publish_snapshot(RAG.build_index(xb, ids, "flat", "l2"), docs, str(tmp_path))
+    store = RAG.RetrievalStore(str(tmp_path), poll_seconds=3600)
+    assert store.refresh()
+    with store.use() as old:
+        RAG.publish_snapshot(RAG.build_index(xb, ids, "flat", "l2"), docs, str(tmp_path))
+        assert store.refresh()
+        # still searchable by the request that holds it
+        assert old.passages.get(3) == "passage 3"
+        assert old.index is not None
+    assert old.index is None and old.passages.data.closed
+    newer = store.current()
+    RAG.publish_snapshot(RAG.build_index(xb, ids, "flat", "l2"), docs, str(tmp_path))
+    assert store.refresh()
+    # nobody was using it: closed right at the swap
+    assert newer.index is None
+
+class StubBackend:
+    cache_model = "test-stub-backend"
+
+    async def embed(self, texts):
+        return [np.full(8, len(t), dtype="float32") for t in texts]
+
+def test_snapshot_records_the_backend_it_was_built_with(tmp_path, monkeypatch):
+    monkeypatch.setitem(embeddings._BACKENDS, "stub", StubBackend())
+    (tmp_path / "notes.txt").write_text("First passage.\n\nSecond, longer passage.")
+    store_dir = str(tmp_path / "store")
+    asyncio.run(RAG.sync_sources([str(tmp_path / "notes.txt")], idx_path=str(tmp_path / "i.faiss"),
+                                 manifest_path=str(tmp_path / "m.sqlite3"), embedding_backend="stub", store_dir=store_dir))
+    store = RAG.RetrievalStore(store_dir)
+    assert store.embedding_backend is None and store.refresh()
+    # /chat embeds its queries with this, so they match the index's dimension
+    assert store.embedding_backend == "stub" and store.stats()["dim"] == 8
+
+def test_sync_waits_for_another_workers_sync(tmp_path, monkeypatch):
+    fcntl = pytest.importorskip("fcntl")
+    monkeypatch.setitem(embeddings._BACKENDS, "stub", StubBackend())
+    (tmp_path / "notes.txt").write_text("Only passage.")
+    manifest = str(tmp_path / "m.sqlite3")
+    async def scenario():
+        # another worker's sync holds the lock; a separate open file behaves like another process
+        with open(f"{manifest}.lock", "a") as other:
+            fcntl.flock(other.fileno(), fcntl.LOCK_EX)
+            task = asyncio.create_task(RAG.sync_sources([str(tmp_path / "notes.txt")], idx_path=str(tmp_path / "i.faiss"),
+                                                        manifest_path=manifest, embedding_backend="stub",
+                                                        store_dir=str(tmp_path / "store")))
+            await asyncio.sleep(0.3)
+            assert not task.done()
+        return await asyncio.wait_for(task, 5)
+    assert asyncio.run(scenario())["chunks"] == 1
@@ -0,0 +1,89 @@
+import pytest
+
+import risk
+
+@pytest.mark.parametrize("text", [
+    "I want to kill myself",
+    "i WANT to DIE",
+    "Sometimes I think about suicide.",
+    "It’s over for me",  # curly apostrophe
+    "I feel like   jumping from the roof",
+    "I might hurt myself tonight",
+    "die",
+    # negations still escalate: the keyword tier errs on the side of a safety reply
+    "I don't want to die",
+    "I would never kill myself",
+])
+def test_urgent_keywords_match(text):
+    assert risk.quick_urgent_check(text)
+
+@pytest.mark.parametrize("text", [
+    "I started a new diet",
+    "My studies are going fine",
+    "I listen to indie music",
+    "The diesel engine broke",
+    "That movie was a killer",
+    "I feel okay today",
+    "",
+])
+def test_urgent_keywords_do_not_match_inside_words(text):
+    assert not risk.quick_urgent_check(text)
+
+@pytest.mark.parametrize("text", ["hi", "Hello!", "  thanks a lot. ", "OK", "Good night?", "thank you so much!!"])
+def test_small_talk_short_circuits(text):
+    verdict = risk.local_risk_screen(text)
+    assert verdict is not None and verdict["tier"] == "small_talk" and verdict["risk_score"] == 0
+
+@pytest.mark.parametrize("text", ["hi, I feel hopeless", "thanks but nothing helps", "no one cares about me", "ok so I want to die"])
+def test_small_talk_needs_the_whole_message(text):
+    verdict = risk.local_risk_screen(text)
+    assert verdict is None or verdict["tier"] != "small_talk"
+
+def test_keyword_pattern_normalizes_its_entries():
+    pattern = risk.compile_keywords(["End my LIFE"])
+    assert pattern.search(risk.normalize("I want to end my life"))
+    assert not pattern.search(risk.normalize("the end of my lifetime"))
+
+RISKY = ["I feel hopeless and want to give up", "nobody would miss me if I was gone", "I can't go on anymore",
+         "everything is pointless and I want it to end", "I keep thinking about ending it all", "I don't see a way out"]
+BENIGN = ["work was stressful today", "I slept badly last night", "my exams are coming up soon",
+          "I had an argument with my friend", "I want to get better at cooking", "the weekend was relaxing"]
+# held-out messages that share words with the other class, so neither threshold is trivial
+AMBIGUOUS = [("I can't go on with this project", 0), ("my job feels pointless", 0), ("I want it to end, this week was long", 0),
+             ("I am so tired of everything", 1), ("what is even the point", 1), ("I feel like giving up on life", 1)]
+
+def labelled(prefixes=("", "honestly ", "lately ")):
+    rows = [(p + t, 1) for p in prefixes for t in RISKY] + [(p + t, 0) for p in prefixes for t in BENIGN]
+    return [t for t, _ in rows], [y for _, y in rows]
+
+def test_calibrate_bounds_misses_and_holds_precision():
+    scorer = risk.NgramRiskScorer.fit(*labelled(), n_features=1 << 14)
+    texts, labels = labelled(("so ", "and "))
+    texts += [t for t, _ in AMBIGUOUS]; labels += [y for _, y in AMBIGUOUS]
+    scorer.calibrate(texts, labels, max_missed=0.1, min_precision=0.9)
+    scores, y = [scorer.score(t) for t in texts], labels
+    positives = [s for s, l in zip(scores, y) if l == 1]
+    # at most max_missed of the risky messages skip the LLM as "low"
+    assert 0.0 < scorer.low and sum(s < scorer.low for s in positives) <= int(0.1 * len(positives))
+    above = [l for s, l in zip(scores, y) if s >= scorer.high]
+    assert scorer.high < 1.0 and above and sum(above) / len(above) >= 0.9
+    # and it is the lowest such threshold: one more score down would break the precision
+    lower = [s for s in scores if s < scorer.high]
+    if lower:
+        below = [l for s, l in zip(scores, y) if s >= max(lower)]
+        assert sum(below) / len(below) < 0.9
+
+def test_loaded_scorer_bands(tmp_path, monkeypatch):
+    n = 1 << 16
+    weights = [0.0] * n
+    for word, w in (("hopeless", 6.0), ("weather", -6.0)):
+        weights[int(risk.NgramRiskScorer.features(word, n)[0])] = w
+    path = str(tmp_path / "risk_model.json")
+    risk.NgramRiskScorer(weights, 0.0, low=0.1, high=0.9).save(path)
+    monkeypatch.setattr(risk, "RISK_SCORER", risk.load_scorer(path))
+    low = risk.local_risk_screen("lovely weather")
+    assert low["label"] == "low" and low["tier"] == "scorer" and low["risk_score"] < 10
+    high = risk.local_risk_screen("I feel hopeless")
+    assert high["label"] == "high" and high["risk_score"] >= risk.RISK_ESCALATE_SCORE
+    # between the thresholds the LLM classifier decides
+    assert risk.local_risk_screen("I had a strange day") is None